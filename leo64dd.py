@@ -5,7 +5,7 @@
 #   Originally sourced from https://github.com/Drahsid/mario-paint
 #
 
-import struct, sys, numpy
+import struct, sys, time, array, bisect, contextlib, threading, numpy
 
 sys_lba_count = 24
 lba_count = 4316
@@ -45,9 +45,78 @@ track_zone_tbl = (
     (0x091, 0x12F, 0x1C4, 0x259, 0x2EE, 0x383, 0x418, 0x48A),
 )
 
+# start offset of each zone in physical block order (head 0 zones 0-7, then head 1 zones 1-8) as used by the MAME file format
+phys_zone_offset_tbl = (0x0,      0x5F15E0, 0xB79D00, 0x10801A0,0x1523720,0x1963D80,0x1D414C0,0x20BBCE0,
+                        0x23196E0,0x28A1E00,0x2DF5DC0,0x3299340,0x36D99A0,0x3AB70E0,0x3E31900,0x4149200)
+
+# instrumentation, None unless enabled (checked before recording anything)
+stats = None
+# counters are updated from worker threads too (conversion, catalog, server)
+stats_lock = threading.Lock()
+
+def enable_stats():
+    """
+    Start recording stage timings, call counts and byte counts (resets previous ones).
+    """
+    global stats
+    stats = { "time": {}, "calls": {}, "bytes": {} }
+
+def disable_stats():
+    """
+    Stop recording.
+    """
+    global stats
+    stats = None
+
+def get_stats() -> dict:
+    """
+    Returns recorded stats as a dict with "time" (seconds per stage), "calls" (count per function or stage)
+    and "bytes" (count per kind), or None if not enabled.
+    """
+    return stats
+
+def add_stats_count(kind: str, name: str, count):
+    current = stats
+    if current is None: return
+    with stats_lock:
+        current[kind][name] = current[kind].get(name, 0) + count
+
+def add_stats_call(name: str, count=1):
+    add_stats_count("calls", name, count)
+
+def add_stats_bytes(name: str, count: int):
+    add_stats_count("bytes", name, count)
+
+@contextlib.contextmanager
+def stats_stage(name: str):
+    """
+    Record the time spent in a with block as a stage, if stats are enabled.
+    """
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stats_count("time", name, time.perf_counter() - start)
+        add_stats_call(name)
+
+def print_stats(report=print):
+    """
+    Print recorded stats.
+    """
+    if stats is None: return
+    for name, value in sorted(stats["time"].items()):
+        report(f"{name:<32} {value * 1000:>12.3f} ms {stats['calls'].get(name, 0):>10} times")
+    for name, value in sorted(stats["calls"].items()):
+        if name not in stats["time"]: report(f"{name:<32} {value:>12} calls")
+    for name, value in sorted(stats["bytes"].items()):
+        report(f"{name:<32} {value:>12} bytes")
+
 class Disk_Sys:
     def __init__(self, d: bytearray):
-        self.raw = d[:232]
+        self.raw = bytearray(d[:232])
         self.reload()
     
     def reload(self):
@@ -71,6 +140,9 @@ class Disk_Sys:
         self.defect_tracks.append(self.raw[0x20:][:self.raw[8]])
         for i in range(1, 16):
             self.defect_tracks.append(self.raw[0x20+self.raw[8:][i-1]:][:self.raw[8:][i] - self.raw[8:][i-1]])
+
+        # defect tracks may have changed, physical map needs to be made again
+        self.phys_map = None
     
     def update(self, defect=True, d64=False):
         """
@@ -89,7 +161,7 @@ class Disk_Sys:
 
         if d64 == False:
             write_32(raw, 0x18, 0xFFFFFFFF)
-            write_16(raw, 0xE8, 0xFFFF)
+            write_16(raw, 0xE6, 0xFFFF)
 
         if defect == True and d64 == False:
             # add defect data back
@@ -101,6 +173,7 @@ class Disk_Sys:
                 raw[0x08+i] = j
         
         self.raw = raw
+        self.phys_map = None
     
     def is_defect_info_valid(self) -> bool:
         """
@@ -158,10 +231,19 @@ class Disk_Sys:
         if self.ram_start_lba == 0xFFFF and self.ram_end_lba == 0xFFFF: return False
         return True
 
+    def get_phys_map(self):
+        """
+        Returns the physical location of every LBA based from Disk Type and defect tracks. (Made on first use, and again after reload() or update().)
+        """
+        if self.phys_map is None or self.phys_map.disk_type != self.disk_type:
+            with stats_stage("phys_map"):
+                self.phys_map = Disk_PhysMap(self)
+        return self.phys_map
+
 
 class Disk_Id:
     def __init__(self, d: bytearray):
-        self.raw = d[:232]
+        self.raw = bytearray(d[:232])
         self.reload()
     
     def reload(self):
@@ -189,10 +271,10 @@ class Disk_Id:
         raw[5] = self.disk_number
         raw[6] = self.ram_use
         raw[7] = self.disk_use
-        raw[8:] = self.factory_line[:8]
-        raw[0x10:] = self.production_time[:8]
-        raw[0x18:] = self.company_code.encode("ASCII")[:2]
-        raw[0x1A:] = self.free_area[:6]
+        raw[0x08:0x10] = self.factory_line[:8]
+        raw[0x10:0x18] = self.production_time[:8]
+        raw[0x18:0x1A] = self.company_code.encode("ASCII")[:2]
+        raw[0x1A:0x20] = self.free_area[:6]
 
         self.raw = raw
 
@@ -223,19 +305,137 @@ class PhysInfo:
                 break
         return int(zone + self.head)
 
+class Disk_Layout:
+    def __init__(self, t: int):
+        self.disk_type = t
+        self.vzone = []
+        self.pzone = []
+        self.size = []
+        self.offset = [0]
+
+        # walk all LBAs once and fill in per LBA info
+        vzone = 0
+        for lba in range(lba_count):
+            while lba >= vzone_lba_tbl[t][vzone]: vzone += 1
+            pzone = pzone_tbl[t][vzone]
+            size = block_size_per_pzone[zone_tbl[pzone]]
+            self.vzone.append(vzone)
+            self.pzone.append(pzone)
+            self.size.append(size)
+            self.offset.append(self.offset[lba] + size)
+
+        self.vzone = tuple(self.vzone)
+        self.pzone = tuple(self.pzone)
+        self.size = tuple(self.size)
+        self.sector_size = tuple(size // sector_count for size in self.size)
+        self.offset = tuple(self.offset)
+
+class Disk_PhysMap:
+    def __init__(self, sys: Disk_Sys):
+        self.disk_type = sys.disk_type
+        self.head = array.array("B")
+        self.track = array.array("H")
+        self.block = array.array("B")
+        self.zone = array.array("B")
+        self.offset = array.array("I")
+
+        layout = get_layout(sys.disk_type)
+        for lba in range(lba_count):
+            # get block info
+            if ((lba & 3) == 0) or ((lba & 3) == 3):
+                r_block = 0
+            else:
+                r_block = 1
+
+            vzone = layout.vzone[lba]
+            pzone = layout.pzone[lba]
+
+            # get head info
+            r_head = pzone // 8
+
+            # get zone
+            zone = pzone - (7 * r_head)
+
+            # get start lba of vzone
+            vzone_start_lba = 0
+            if vzone > 0: vzone_start_lba = vzone_lba_tbl[sys.disk_type][vzone - 1]
+
+            # get current track of vzone
+            r_track = (lba - vzone_start_lba) // 2
+
+            # get start/end track of zone
+            pzone_start_track = track_zone_tbl[0][zone - r_head]
+
+            # count from the opposite side if head 1
+            if r_head == 1: r_track = -r_track
+            r_track += track_zone_tbl[r_head][zone - r_head]
+
+            # skip defective tracks
+            for i in sys.defect_tracks[pzone]:
+                if (pzone_start_track + i) > r_track: break
+                r_track += 1
+
+            # get disk zone and physical offset
+            r_zone = PhysInfo(r_head, r_track, r_block).get_zone()
+            track_relative = r_track - track_zone_tbl[0][r_zone - r_head]
+            offset = phys_zone_offset_tbl[(r_zone - r_head) + (r_head * 8)]
+            offset += block_size_per_pzone[r_zone] * 2 * track_relative
+            offset += r_block * block_size_per_pzone[r_zone]
+
+            self.head.append(r_head)
+            self.track.append(r_track)
+            self.block.append(r_block)
+            self.zone.append(r_zone)
+            self.offset.append(offset)
+
+        # reverse lookups: physical location to LBA, and LBAs sorted by offset
+        self.phys_lba = { (self.head[lba], self.track[lba], self.block[lba]): lba for lba in range(lba_count) }
+        self.sorted_lba = array.array("H", sorted(range(lba_count), key=self.offset.__getitem__))
+        self.sorted_offset = array.array("I", [self.offset[lba] for lba in self.sorted_lba])
+
+    def get_phys(self, lba: int) -> PhysInfo:
+        """
+        Returns physical disk geometry information of LBA.
+        """
+        return PhysInfo(self.head[lba], self.track[lba], self.block[lba])
+
+    def get_lba(self, phys: PhysInfo) -> int:
+        """
+        Returns the LBA at a physical location, or -1 if there is none (defect track or outside of the disk).
+        """
+        return self.phys_lba.get((phys.head, phys.track, phys.block), -1)
+
+    def offset_to_lba(self, offset: int) -> int:
+        """
+        Returns the LBA stored at byte offset in physical block order, or -1 if there is none.
+        """
+        i = bisect.bisect_right(self.sorted_offset, offset) - 1
+        if i < 0: return -1
+        lba = self.sorted_lba[i]
+        if offset >= self.offset[lba] + get_layout(self.disk_type).size[lba]: return -1
+        return lba
+
+disk_layouts = [None] * 7
+
+def get_layout(t: int) -> Disk_Layout:
+    """
+    Returns the precomputed LBA layout of any given Disk Type. (Built on first use.)
+    """
+    layout = disk_layouts[t]
+    if layout is None:
+        with stats_stage("layout"):
+            layout = Disk_Layout(t)
+        disk_layouts[t] = layout
+    return layout
+
 # LBA to VZone (disktype, lba)
 def lba_to_vzone(t: int, lba: int) -> int:
     """
     Returns Virtual Zone information based from Disk Type and LBA.
     """
-    vzone = 0
-
-    for i in reversed(range(16)):
-        if lba < vzone_lba_tbl[t][i]:
-            vzone = i
-        else:
-            break
-    return int(vzone)
+    if stats is not None: add_stats_call("lba_to_vzone")
+    if lba < 0 or lba >= lba_count: return 0
+    return get_layout(t).vzone[lba]
 
 # VZone to PZone (disktype, vzone)
 def vzone_to_pzone(t: int, vzone: int) -> int:
@@ -251,38 +451,67 @@ def pzone_to_zone(vzone: int) -> int:
     """
     return int(zone_tbl[vzone])
 
+# LBAs of PZone (disktype, pzone)
+def pzone_to_lbas(t: int, pzone: int) -> range:
+    """
+    Returns the range of LBAs stored in a Physical Zone on any given Disk Type. (All of them have the same block size.)
+    """
+    if pzone < 0 or pzone >= len(zone_tbl): raise ValueError()
+    vzone = pzone_tbl[t].index(pzone)
+    start = 0 if vzone == 0 else vzone_lba_tbl[t][vzone - 1]
+    return range(start, vzone_lba_tbl[t][vzone])
+
 # Block Size of LBA (disktype, lba)
 def size_of_lba(t: int, lba: int) -> int:
     """
     Returns the block byte size of any given LBA on any given Disk Type.
     """
-    return int(block_size_per_pzone[pzone_to_zone(vzone_to_pzone(t, lba_to_vzone(t, lba)))])
+    if stats is not None: add_stats_call("size_of_lba")
+    if lba < 0 or lba >= lba_count: return block_size_per_pzone[0]
+    return get_layout(t).size[lba]
 
 # Sector Size of LBA (disktype, lba)
 def size_of_sectors(t: int, lba: int) -> int:
     """
     Returns the sector byte size of any given LBA on any given Disk Type.
     """
-    return int(size_of_lba(t, lba) / sector_count)
+    if stats is not None: add_stats_call("size_of_sectors")
+    if lba < 0 or lba >= lba_count: return block_size_per_pzone[0] // sector_count
+    return get_layout(t).sector_size[lba]
 
 # Size of LBAs (disktype, first LBA, LBA amount)
 def lba_to_byte(t: int, start_lba: int, nlba: int) -> int:
     """
     Returns the byte size of any given LBA and n amount of blocks from it on any given Disk Type.
     """
-    if (start_lba >= lba_count): raise ValueError()
+    if stats is not None: add_stats_call("lba_to_byte")
+    if (start_lba < 0 or start_lba >= lba_count): raise ValueError()
     if (start_lba + nlba > lba_count): raise ValueError()
-    return int(sum([size_of_lba(t, i) for i in range(start_lba, start_lba + nlba)]))
+    if (nlba <= 0): return 0
+    offset = get_layout(t).offset
+    return offset[start_lba + nlba] - offset[start_lba]
 
 # LBA amount from byte size (disktype, first LBA, byte amount)
 def byte_to_lba(t: int, start_lba: int, nbytes: int) -> int:
     """
     Returns the size in LBA blocks of any given LBA and n amount of bytes from it on any given Disk Type.
     """
-    for i in range(start_lba, lba_count):
-        nbytes -= size_of_lba(t, i)
-        if (nbytes <= 0): return int(i - start_lba)
-    raise ValueError()
+    if stats is not None: add_stats_call("byte_to_lba")
+    if (start_lba < 0 or start_lba >= lba_count): raise ValueError()
+    offset = get_layout(t).offset
+    # first LBA where the bytes end
+    end = bisect.bisect_left(offset, offset[start_lba] + nbytes, start_lba + 1)
+    if (end > lba_count): raise ValueError()
+    return end - 1 - start_lba
+
+# LBA at byte offset (disktype, byte offset)
+def byte_offset_to_lba(t: int, offset: int) -> int:
+    """
+    Returns the LBA at any given byte offset of the LBA blocks (in LBA order, like NDD file format) on any given Disk Type.
+    """
+    if stats is not None: add_stats_call("byte_offset_to_lba")
+    if (offset < 0 or offset >= get_layout(t).offset[lba_count]): raise ValueError()
+    return bisect.bisect_right(get_layout(t).offset, offset) - 1
 
 def read_16(b, offset):
     """
@@ -312,50 +541,32 @@ def verify_sec_repeat_block(d: bytearray, secsize: int) -> bool:
     """
     Compares all sectors in a given block of data and sector size and returns True if they are all identical to each other. If not, returns False.
     """
-    comp = d[:secsize]
-    # compare all sectors if they're identical or not
-    for i in range(1, sector_count):
-        if (all([comp == d[i*secsize:][:secsize]]) == False): return False
-    return True
+    if len(d) < sector_count * secsize: return False
+    # compare all sectors against the first one without copying them
+    sectors = numpy.frombuffer(d, dtype=numpy.uint8, count=sector_count * secsize).reshape(sector_count, secsize)
+    return bool((sectors == sectors[0]).all())
+
+def verify_sec_repeat_blocks(d: numpy.ndarray, secsize: int) -> numpy.ndarray:
+    """
+    Same as verify_sec_repeat_block, but for several blocks at once given as a 2D array (one block per row).
+    Returns an array of bool, True for each block with all sectors identical.
+    """
+    sectors = d[:, :sector_count * secsize].reshape(len(d), sector_count, secsize)
+    return (sectors == sectors[:, :1]).all(axis=(1, 2))
 
 def lba_to_phys(sys: Disk_Sys, lba: int) -> PhysInfo:
     """
     Returns physical disk geometry information based from provided Disk System Data Formatting information and LBA.
     """
+    if stats is not None: add_stats_call("lba_to_phys")
     if lba < 0 or lba >= lba_count: raise ValueError()
+    phys_map = sys.get_phys_map()
+    return PhysInfo(phys_map.head[lba], phys_map.track[lba], phys_map.block[lba])
 
-    # get block info
-    if ((int(lba) & 3) == 0) or ((int(lba) & 3) == 3):
-        r_block = int(0)
-    else:
-        r_block = int(1)
-
-    vzone = lba_to_vzone(sys.disk_type, lba)
-    pzone = vzone_to_pzone(sys.disk_type, vzone)
-
-    # get head info
-    r_head = int(pzone / 8)
-
-    # get zone
-    zone = int(pzone - (7 * r_head))
-
-    # get start lba of vzone
-    vzone_start_lba = 0
-    if vzone > 0: vzone_start_lba = vzone_lba_tbl[sys.disk_type][vzone - 1]
-
-    # get current track of vzone
-    r_track = int((lba - vzone_start_lba) / 2)
-
-    # get start/end track of zone
-    pzone_start_track = int(track_zone_tbl[0][zone - r_head])
-
-    # count from the opposite side if head 1
-    if r_head == 1: r_track = -r_track
-    r_track += track_zone_tbl[r_head][zone - r_head]
-
-    # skip defective tracks
-    for i in sys.defect_tracks[pzone]:
-        if (pzone_start_track + i) > r_track: break
-        r_track += 1
-
-    return PhysInfo(r_head, r_track, r_block)
+def phys_to_lba(sys: Disk_Sys, phys: PhysInfo) -> int:
+    """
+    Returns LBA based from provided Disk System Data Formatting information and physical disk geometry location.
+    Returns -1 if no LBA is there (defect track or outside of the disk).
+    """
+    if stats is not None: add_stats_call("phys_to_lba")
+    return sys.get_phys_map().get_lba(phys)
@@ -0,0 +1,239 @@
+#
+#   64DD Benchmark + Synthetic Disk Generator
+#
+
+import sys, os, json, time, random, leo64dd, leo64ddfile
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def make_sys_data(disk_type: int, development=False, ram=True, rnd=random) -> leo64dd.Disk_Sys:
+    """
+    Make System Data for any given Disk Type with random defect tracks.
+    """
+    sys_data = leo64dd.Disk_Sys(bytearray(232))
+    sys_data.region = 0x00000000 if development == True else rnd.choice((0xE848D316, 0x2263EE56))
+    sys_data.fmt_type = 0x10
+    sys_data.disk_type = disk_type
+    sys_data.ipl_load_size = rnd.randint(1, 64)
+    sys_data.ipl_load_addr = 0x80000400
+    sys_data.rom_end_lba = leo64dd.ram_lba_start_tbl[disk_type] - leo64dd.sys_lba_count - 1
+    if ram == True and disk_type != 6:
+        sys_data.ram_start_lba = leo64dd.ram_lba_start_tbl[disk_type] - leo64dd.sys_lba_count
+        sys_data.ram_end_lba = leo64dd.lba_count - leo64dd.sys_lba_count - 1
+    else:
+        sys_data.ram_start_lba = 0xFFFF
+        sys_data.ram_end_lba = 0xFFFF
+
+    while True:
+        # 1 to 3 defect tracks per zone, tracks 0-7 of the first zone are kept free as they hold System Data and Disk ID
+        sys_data.defect_tracks = []
+        for pzone in range(16):
+            tracks = rnd.sample(range(8 if pzone == 0 else 0, 12), rnd.randint(1, 3))
+            sys_data.defect_tracks.append(bytearray(sorted(tracks)))
+        sys_data.update()
+        # every LBA must have its own physical location
+        if len(set(sys_data.get_phys_map().offset)) == leo64dd.lba_count: break
+    return sys_data
+
+def make_disk_id(rnd=random) -> leo64dd.Disk_Id:
+    """
+    Make random Disk ID.
+    """
+    disk_id = leo64dd.Disk_Id(bytearray(232))
+    disk_id.initial_code = "".join(rnd.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for i in range(3)) + rnd.choice("JEP")
+    disk_id.game_version = rnd.randint(0, 3)
+    disk_id.disk_number = 0
+    disk_id.ram_use = rnd.randint(0, 1)
+    disk_id.disk_use = 0
+    disk_id.factory_line = bytearray(rnd.randbytes(8))
+    disk_id.production_time = bytearray(rnd.randbytes(8))
+    disk_id.company_code = "01"
+    disk_id.free_area = bytearray(6)
+    disk_id.update()
+    return disk_id
+
+def make_ndd(disk_type: int, development=False, ram=True, seed=0) -> leo64ddfile.Disk_NDD:
+    """
+    Make a valid synthetic NDD disk for any given Disk Type, with random ROM Area (and RAM Area if ram is True) data.
+    """
+    rnd = random.Random(seed)
+    sys_data = make_sys_data(disk_type, development, ram, rnd)
+    disk_id = make_disk_id(rnd)
+    layout = leo64dd.get_layout(disk_type)
+
+    d = bytearray(leo64ddfile.size_format_ndd)
+    # System Data copies
+    if development == True:
+        lbas = leo64dd.sys_lba_tbl_dev
+        secsize = 0xC0
+    else:
+        lbas = leo64dd.sys_lba_tbl_retail
+        secsize = 0xE8
+    for i in lbas:
+        d[layout.offset[i]:layout.offset[i] + secsize * leo64dd.sector_count] = sys_data.raw[:secsize] * leo64dd.sector_count
+    # Disk ID copies
+    for i in leo64dd.sys_lba_tbl_diskid:
+        d[layout.offset[i]:layout.offset[i] + 0xE8 * leo64dd.sector_count] = disk_id.raw * leo64dd.sector_count
+    # ROM Area
+    start = layout.offset[leo64dd.sys_lba_count]
+    end = layout.offset[leo64dd.sys_lba_count + sys_data.rom_end_lba + 1]
+    d[start:end] = rnd.randbytes(end - start)
+    # RAM Area
+    if sys_data.is_ram_lba_info_present() == True:
+        start = layout.offset[leo64dd.sys_lba_count + sys_data.ram_start_lba]
+        end = layout.offset[leo64dd.sys_lba_count + sys_data.ram_end_lba + 1]
+        d[start:end] = rnd.randbytes(end - start)
+
+    disk = leo64ddfile.Disk_NDD()
+    disk.load(d)
+    return disk
+
+def make_disk_files(disk_type: int, development=False, ram=True, seed=0) -> dict:
+    """
+    Make synthetic disk files of the same disk in all formats. Returns a dict of format ("ndd", "mame", "d64") to bytearray.
+    """
+    ndd = make_ndd(disk_type, development, ram, seed)
+    mame = leo64ddfile.Disk_MAME()
+    mame.convert(ndd)
+    d64 = leo64ddfile.Disk_D64()
+    # D64 conversion changes the System Data of the disk it converts from, use a copy
+    d64.convert(load_disk(leo64ddfile.Disk_NDD, ndd.raw))
+    return { "ndd": ndd.raw, "mame": mame.raw, "d64": d64.raw }
+
+def load_disk(disk_class, d: bytearray):
+    """
+    Returns a new disk class loaded from data.
+    """
+    disk = disk_class()
+    disk.load(d)
+    return disk
+
+def copy_disk(disk):
+    """
+    Returns a new disk class sharing the data of disk, with its own System Data and Disk ID. (D64 conversion changes them.)
+    """
+    copy = type(disk)()
+    copy.__dict__.update(disk.__dict__)
+    copy.sys_data = leo64dd.Disk_Sys(disk.sys_data.raw)
+    copy.sys_data.phys_map = disk.sys_data.phys_map
+    copy.disk_id = leo64dd.Disk_Id(disk.disk_id.raw)
+    if type(disk) is leo64ddfile.Disk_D64: copy.sys_blocks = {}
+    return copy
+
+def get_peak_rss() -> int:
+    """
+    Returns peak resident memory of the process in bytes, or 0 if not known.
+    """
+    if resource is None: return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin": return rss
+    return rss * 1024
+
+def bench(func, ops: int, repeat: int, setup=None) -> dict:
+    """
+    Time func, best of repeat runs. Returns a dict with "time" (seconds) and "ops" (operations per second).
+    If setup is given, it is called (not timed) before each run and its result is given to func.
+    """
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            arg = setup()
+            start = time.perf_counter()
+            func(arg)
+        else:
+            start = time.perf_counter()
+            func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best: best = elapsed
+    return { "time": best, "ops": ops / max(best, 1e-9) }
+
+def run_benchmarks(disk_types=range(7), repeat=3, seed=0, report=print) -> dict:
+    """
+    Run all benchmarks for given Disk Types. Returns a dict of benchmark name to result (see bench).
+    """
+    results = {}
+    def run(name, func, ops, setup=None):
+        results[name] = bench(func, ops, repeat, setup)
+        report(f"{name:<32} {results[name]['ops']:>14.1f} ops/s {results[name]['time'] * 1000:>10.3f} ms")
+
+    classes = { "ndd": leo64ddfile.Disk_NDD, "mame": leo64ddfile.Disk_MAME, "d64": leo64ddfile.Disk_D64 }
+    rnd = random.Random(seed)
+    for t in disk_types:
+        files = make_disk_files(t, development=(t % 2 == 1), ram=True, seed=seed + t)
+        disks = { fmt: load_disk(classes[fmt], d) for fmt, d in files.items() }
+        seq_lbas = list(range(leo64dd.lba_count))
+        rand_lbas = [rnd.randrange(leo64dd.lba_count) for i in range(leo64dd.lba_count)]
+
+        for fmt, d in files.items():
+            run(f"t{t}.load.{fmt}", lambda: load_disk(classes[fmt], d), 1)
+        for fmt, disk in disks.items():
+            run(f"t{t}.get_lba.seq.{fmt}", lambda: [disk.get_lba(i) for i in seq_lbas], len(seq_lbas))
+            run(f"t{t}.get_lba.rand.{fmt}", lambda: [disk.get_lba(i) for i in rand_lbas], len(rand_lbas))
+        for src in classes:
+            for dst in classes:
+                if src == dst: continue
+                # D64 conversion changes the disk it converts from, always convert from a new copy (made before timing)
+                run(f"t{t}.convert.{src}.{dst}", lambda disk: classes[dst]().convert(disk), 1, lambda: copy_disk(disks[src]))
+
+        sys_data = disks["ndd"].sys_data
+        run(f"t{t}.size_of_lba", lambda: [leo64dd.size_of_lba(t, i) for i in seq_lbas], len(seq_lbas))
+        run(f"t{t}.lba_to_byte", lambda: [leo64dd.lba_to_byte(t, 0, i) for i in seq_lbas], len(seq_lbas))
+        run(f"t{t}.lba_to_phys", lambda: [leo64dd.lba_to_phys(sys_data, i) for i in seq_lbas], len(seq_lbas))
+        run(f"t{t}.byte_to_lba", lambda: [leo64dd.byte_to_lba(t, 0, n) for n in range(1, 0x3D00000, 0xF000)], len(range(1, 0x3D00000, 0xF000)))
+
+    results["peak_rss"] = get_peak_rss()
+    report(f"Peak RSS: {results['peak_rss'] / 0x100000:.1f} MB")
+    return results
+
+def compare_results(results: dict, baseline: dict, threshold=0.1, report=print) -> list:
+    """
+    Compare results against baseline results, and return the names of benchmarks slower by more than threshold (ratio).
+    """
+    slower = []
+    for name, result in results.items():
+        if name == "peak_rss" or name not in baseline: continue
+        ratio = result["ops"] / max(baseline[name]["ops"], 1e-9)
+        mark = ""
+        if ratio < 1.0 - threshold:
+            slower.append(name)
+            mark = " (slower)"
+        report(f"{name:<32} {ratio:>8.2f}x{mark}")
+    if "peak_rss" in baseline and baseline["peak_rss"] != 0:
+        report(f"Peak RSS: {results['peak_rss'] / baseline['peak_rss']:.2f}x")
+    return slower
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    out_path = None
+    baseline_path = None
+    disk_types = range(7)
+    repeat = 3
+    i = 0
+    while i < len(args):
+        if args[i] == "-o" and i + 1 < len(args): out_path = args[i + 1]
+        elif args[i] == "-b" and i + 1 < len(args): baseline_path = args[i + 1]
+        elif args[i] == "-t" and i + 1 < len(args): disk_types = [int(t) for t in args[i + 1].split(",")]
+        elif args[i] == "-n" and i + 1 < len(args): repeat = int(args[i + 1])
+        else:
+            print(f"Usage: {sys.argv[0]} [-t disk_types] [-n repeat] [-o results.json] [-b baseline.json]")
+            print(" -t = comma separated Disk Types to benchmark (default: 0,1,2,3,4,5,6)")
+            print(" -n = amount of runs for each benchmark, best one is kept (default: 3)")
+            print(" -o = save results to JSON file")
+            print(" -b = compare results against JSON file saved with -o")
+            sys.exit(2)
+        i += 2
+
+    results = run_benchmarks(disk_types, repeat)
+    if out_path is not None:
+        with open(out_path, "w") as outfile:
+            json.dump(results, outfile, indent=1)
+    if baseline_path is not None:
+        with open(baseline_path, "r") as infile:
+            baseline = json.load(infile)
+        print("Compared to baseline:")
+        if len(compare_results(results, baseline)) != 0: sys.exit(1)
+    sys.exit(0)
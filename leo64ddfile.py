@@ -2,7 +2,7 @@
 #   64DD File Module + Conversion
 #
 
-import sys, leo64dd
+import sys, os, io, glob, json, time, atexit, bisect, mmap, zlib, gzip, lzma, bz2, zipfile, tempfile, shutil, struct, hashlib, threading, contextlib, collections, concurrent.futures, numpy, leo64dd
 
 size_format_ndd = 0x3DEC800
 size_format_mame = 0x435B0C0
@@ -11,6 +11,7 @@ size_format_mame = 0x435B0C0
 class Disk_NDD: pass
 class Disk_MAME: pass
 class Disk_D64: pass
+class Disk_ZDD: pass
 
 # NDD format class
 class Disk_NDD:
@@ -18,11 +19,14 @@ class Disk_NDD:
         # check size of NDD file
         if len(d) != size_format_ndd: raise Exception("Wrong size of NDD file")
 
+        # check all system and disk id blocks at once
+        good = scan_sys_blocks(d)
+
         # find good retail sys block
         sys_lba = -1
         for i in leo64dd.sys_lba_tbl_retail:
-            block = d[leo64dd.lba_to_byte(0, 0, i):][:leo64dd.size_of_lba(0, i)]
-            if leo64dd.verify_sec_repeat_block(block, 0xE8):
+            block = get_block_view(d, leo64dd.lba_to_byte(0, 0, i), leo64dd.size_of_lba(0, i))
+            if good["retail"][i]:
                 sys_data = leo64dd.Disk_Sys(block)
                 if sys_data.is_info_valid() == False: continue
                 if sys_data.is_defect_info_valid() == False: continue
@@ -34,8 +38,8 @@ class Disk_NDD:
         # find good dev sys block (if retail not found, else don't bother)
         for i in leo64dd.sys_lba_tbl_dev:
             if sys_lba != -1: break
-            block = d[leo64dd.lba_to_byte(0, 0, i):][:leo64dd.size_of_lba(0, i)]
-            if leo64dd.verify_sec_repeat_block(block, 0xC0):
+            block = get_block_view(d, leo64dd.lba_to_byte(0, 0, i), leo64dd.size_of_lba(0, i))
+            if good["dev"][i]:
                 sys_data = leo64dd.Disk_Sys(block)
                 if sys_data.is_info_valid() == False: continue
                 if sys_data.is_defect_info_valid() == False: continue
@@ -50,8 +54,8 @@ class Disk_NDD:
         # find good disk id block
         diskid_lba = -1
         for i in leo64dd.sys_lba_tbl_diskid:
-            block = d[leo64dd.lba_to_byte(self.sys_data.disk_type, 0, i):][:leo64dd.size_of_lba(self.sys_data.disk_type, i)]
-            if leo64dd.verify_sec_repeat_block(block, 0xE8):
+            block = get_block_view(d, leo64dd.lba_to_byte(self.sys_data.disk_type, 0, i), leo64dd.size_of_lba(self.sys_data.disk_type, i))
+            if good["diskid"][i]:
                 diskid_lba = i
                 self.disk_id = leo64dd.Disk_Id(block)
                 break
@@ -60,55 +64,95 @@ class Disk_NDD:
         if diskid_lba == -1: raise Exception("Cannot find valid Disk ID Data")
 
         self.raw = d
+        self.dirty = {}
 
-    def convert(self, disk):
-        if type(disk) is Disk_MAME:
-            # set everything
-            self.raw = bytearray(size_format_ndd)
-            self.sys_data = disk.sys_data
-            self.disk_id = disk.disk_id
-            self.development = disk.development
-            # copy each block one by one
-            for i in range(leo64dd.lba_count):
-                position = self.get_lba_offset(i)
-                size = leo64dd.size_of_lba(disk.sys_data.disk_type, i)
-                self.raw[position:position+size] = disk.get_lba(i)
-        elif type(disk) is Disk_D64:
+    def convert(self, disk, raw=None, threads=1):
+        size = self.convert_info(disk)
+        if raw is not None and len(raw) != size: raise Exception("Wrong size of output buffer")
+        self.raw = bytearray(size) if raw is None else raw
+        if leo64dd.stats is not None and raw is None: leo64dd.add_stats_bytes("alloc", size)
+        self.dirty = {}
+        # copy all blocks zone by zone in bulk if possible
+        if convert_blocks(self, disk, threads) == True: return
+        # else copy each block one by one
+        copy_blocks(self, disk, self.get_file_lbas(), threads)
+
+    def convert_info(self, disk) -> int:
+        """
+        Set disk information from the disk to convert, and return the size of the converted file.
+        """
+        if type(disk) is Disk_Cache: disk = disk.disk
+        if type(disk) is Disk_MAME or type(disk) is Disk_D64 or type(disk) is Disk_ZDD:
             # set everything
-            self.raw = bytearray(size_format_ndd)
             self.sys_data = disk.sys_data
             self.disk_id = disk.disk_id
             self.development = disk.development
-            # copy each block one by one
-            for i in range(leo64dd.lba_count):
-                position = self.get_lba_offset(i)
-                size = leo64dd.size_of_lba(disk.sys_data.disk_type, i)
-                self.raw[position:position+size] = disk.get_lba(i, makesys=True)
         elif type(disk) is Disk_NDD:
             raise Exception("Converting with identical disk object.")
         else:
             raise Exception("Converting with unknown disk object.")
+        return size_format_ndd
+
+    def get_file_header(self) -> bytearray:
+        """
+        Returns the data stored before the blocks in the file.
+        """
+        return bytearray()
 
+    def get_file_lbas(self) -> list:
+        """
+        Returns all LBAs stored in the file, in file order.
+        """
+        return list(range(leo64dd.lba_count))
 
     def get_lba_offset(self, lba: int) -> int:
         return leo64dd.lba_to_byte(self.sys_data.disk_type, 0, lba)
     
     def get_lba(self, lba: int) -> bytearray:
-        return self.raw[self.get_lba_offset(lba):][:leo64dd.size_of_lba(self.sys_data.disk_type, lba)]
-    
+        offset = self.get_lba_offset(lba)
+        size = leo64dd.size_of_lba(self.sys_data.disk_type, lba)
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("get_lba", size)
+        return self.raw[offset:offset+size]
+
+    def get_lba_view(self, lba: int, writable=False) -> memoryview:
+        return get_block_view(self.raw, self.get_lba_offset(lba), leo64dd.size_of_lba(self.sys_data.disk_type, lba), writable)
+
+    def iter_lbas(self, order="logical", start=0, end=leo64dd.lba_count):
+        return iter_lbas(self, order, start, end)
+
+    def get_sectors(self, lba: int, writable=False) -> numpy.ndarray:
+        return get_sectors(self, lba, writable)
+
+    def get_zone_sectors(self, pzone: int, writable=False) -> numpy.ndarray:
+        return get_zone_sectors(self, pzone, writable)
+
+    def boot_image(self, out=None, digest=None):
+        return get_boot_image(self, out, digest)
+
+    def put_lba(self, lba: int, data):
+        put_block(self, lba, data)
+
+    def put_sector(self, lba: int, sector: int, data):
+        put_block(self, lba, data, sector)
+
+    def flush(self, out=None, fsync=False) -> int:
+        return flush_disk(self, out, fsync)
+        
 class Disk_MAME:
-    mame_offset_table = (0x0,      0x5F15E0, 0xB79D00, 0x10801A0,0x1523720,0x1963D80,0x1D414C0,0x20BBCE0,
-                         0x23196E0,0x28A1E00,0x2DF5DC0,0x3299340,0x36D99A0,0x3AB70E0,0x3E31900,0x4149200)
+    mame_offset_table = leo64dd.phys_zone_offset_tbl
     
     def load(self, d: bytearray):
         # check size of MAME file
         if len(d) != size_format_mame: raise Exception("Wrong size of MAME file")
 
+        # check all system and disk id blocks at once
+        good = scan_sys_blocks(d)
+
         # find good retail sys block
         sys_lba = -1
         for i in leo64dd.sys_lba_tbl_retail:
-            block = d[leo64dd.lba_to_byte(0, 0, i):][:leo64dd.size_of_lba(0, i)]
-            if leo64dd.verify_sec_repeat_block(block, 0xE8):
+            block = get_block_view(d, leo64dd.lba_to_byte(0, 0, i), leo64dd.size_of_lba(0, i))
+            if good["retail"][i]:
                 sys_data = leo64dd.Disk_Sys(block)
                 if sys_data.is_info_valid() == False: continue
                 if sys_data.is_defect_info_valid() == False: continue
@@ -120,8 +164,8 @@ class Disk_MAME:
         # find good dev sys block (if retail not found, else don't bother)
         for i in leo64dd.sys_lba_tbl_dev:
             if sys_lba != -1: break
-            block = d[leo64dd.lba_to_byte(0, 0, i):][:leo64dd.size_of_lba(0, i)]
-            if leo64dd.verify_sec_repeat_block(block, 0xC0):
+            block = get_block_view(d, leo64dd.lba_to_byte(0, 0, i), leo64dd.size_of_lba(0, i))
+            if good["dev"][i]:
                 sys_data = leo64dd.Disk_Sys(block)
                 if sys_data.is_info_valid() == False: continue
                 if sys_data.is_defect_info_valid() == False: continue
@@ -136,8 +180,8 @@ class Disk_MAME:
         # find good disk id block
         diskid_lba = -1
         for i in leo64dd.sys_lba_tbl_diskid:
-            block = d[leo64dd.lba_to_byte(self.sys_data.disk_type, 0, i):][:leo64dd.size_of_lba(self.sys_data.disk_type, i)]
-            if leo64dd.verify_sec_repeat_block(block, 0xE8):
+            block = get_block_view(d, leo64dd.lba_to_byte(self.sys_data.disk_type, 0, i), leo64dd.size_of_lba(self.sys_data.disk_type, i))
+            if good["diskid"][i]:
                 diskid_lba = i
                 self.disk_id = leo64dd.Disk_Id(block)
                 break
@@ -146,57 +190,88 @@ class Disk_MAME:
         if diskid_lba == -1: raise Exception("Cannot find valid Disk ID Data")
 
         self.raw = d
+        self.dirty = {}
     
-    def convert(self, disk):
-        if type(disk) is Disk_NDD:
-            # set everything
-            self.raw = bytearray(size_format_mame)
-            self.sys_data = disk.sys_data
-            self.disk_id = disk.disk_id
-            self.development = disk.development
-            # copy each block one by one
-            for i in range(leo64dd.lba_count):
-                position = self.get_lba_offset(i)
-                size = leo64dd.size_of_lba(disk.sys_data.disk_type, i)
-                self.raw[position:position+size] = disk.get_lba(i)
-        elif type(disk) is Disk_D64:
+    def convert(self, disk, raw=None, threads=1):
+        size = self.convert_info(disk)
+        if raw is not None and len(raw) != size: raise Exception("Wrong size of output buffer")
+        self.raw = bytearray(size) if raw is None else raw
+        if leo64dd.stats is not None and raw is None: leo64dd.add_stats_bytes("alloc", size)
+        self.dirty = {}
+        # copy all blocks zone by zone in bulk if possible
+        if convert_blocks(self, disk, threads) == True: return
+        # else copy each block one by one
+        copy_blocks(self, disk, self.get_file_lbas(), threads)
+
+    def convert_info(self, disk) -> int:
+        """
+        Set disk information from the disk to convert, and return the size of the converted file.
+        """
+        if type(disk) is Disk_Cache: disk = disk.disk
+        if type(disk) is Disk_NDD or type(disk) is Disk_D64 or type(disk) is Disk_ZDD:
             # set everything
-            self.raw = bytearray(size_format_mame)
             self.sys_data = disk.sys_data
             self.disk_id = disk.disk_id
             self.development = disk.development
-            # copy each block one by one
-            for i in range(leo64dd.lba_count):
-                position = self.get_lba_offset(i)
-                size = leo64dd.size_of_lba(disk.sys_data.disk_type, i)
-                self.raw[position:position+size] = disk.get_lba(i, makesys=True)
         elif type(disk) is Disk_MAME:
             raise Exception("Converting with identical disk object.")
         else:
             raise Exception("Converting with unknown disk object.")
-    
+        return size_format_mame
+
+    def get_file_header(self) -> bytearray:
+        """
+        Returns the data stored before the blocks in the file.
+        """
+        return bytearray()
+
+    def get_file_lbas(self) -> list:
+        """
+        Returns all LBAs stored in the file, in file order.
+        """
+        return list(self.sys_data.get_phys_map().sorted_lba)
+
     def get_lba_offset(self, lba: int) -> int:
-        # calculate physical geometry data and zone information
-        phys = leo64dd.lba_to_phys(self.sys_data, lba)
-        zone = phys.get_zone()
-        # calculate track info relative to the start of the zone
-        trackRelative = phys.track - leo64dd.track_zone_tbl[0][zone - phys.head]
-        # calculate offset
-        offset = self.mame_offset_table[(zone - phys.head) + (phys.head * 8)]
-        offset += leo64dd.block_size_per_pzone[zone] * 2 * trackRelative
-        offset += phys.block * leo64dd.block_size_per_pzone[zone]
-        return int(offset)
+        # physical offset is calculated once per disk with defect tracks taken in account
+        if lba < 0 or lba >= leo64dd.lba_count: raise ValueError()
+        return self.sys_data.get_phys_map().offset[lba]
     
     def get_lba(self, lba: int) -> bytearray:
         offset = self.get_lba_offset(lba)
-        return self.raw[offset:][:leo64dd.size_of_lba(self.sys_data.disk_type, lba)]
+        size = leo64dd.size_of_lba(self.sys_data.disk_type, lba)
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("get_lba", size)
+        return self.raw[offset:offset+size]
+
+    def get_lba_view(self, lba: int, writable=False) -> memoryview:
+        return get_block_view(self.raw, self.get_lba_offset(lba), leo64dd.size_of_lba(self.sys_data.disk_type, lba), writable)
+
+    def iter_lbas(self, order="logical", start=0, end=leo64dd.lba_count):
+        return iter_lbas(self, order, start, end)
+
+    def get_sectors(self, lba: int, writable=False) -> numpy.ndarray:
+        return get_sectors(self, lba, writable)
+
+    def get_zone_sectors(self, pzone: int, writable=False) -> numpy.ndarray:
+        return get_zone_sectors(self, pzone, writable)
+
+    def boot_image(self, out=None, digest=None):
+        return get_boot_image(self, out, digest)
 
+    def put_lba(self, lba: int, data):
+        put_block(self, lba, data)
+
+    def put_sector(self, lba: int, sector: int, data):
+        put_block(self, lba, data, sector)
+
+    def flush(self, out=None, fsync=False) -> int:
+        return flush_disk(self, out, fsync)
+    
 class Disk_D64:
     def load(self, d: bytearray):
         # check system data
         self.sys_data = leo64dd.Disk_Sys(d[:0xE8])
         if self.sys_data.is_info_valid(d64=True) == False: raise Exception("Disk System Data is invalid.")
-        self.disk_id = leo64dd.Disk_Id(d[0x100:][:0xE8])
+        self.disk_id = leo64dd.Disk_Id(d[0x100:0x1E8])
         self.development = True
 
         # check size of D64 file
@@ -207,9 +282,26 @@ class Disk_D64:
         if len(d) != size: raise Exception("Wrong size of D64 file")
 
         self.raw = d
+        self.sys_blocks = {}
+        self.dirty = {}
+
+    def convert(self, disk, threads=1):
+        size = self.convert_info(disk)
+        # make new raw data
+        self.raw = bytearray(size)
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("alloc", size)
+        self.dirty = {}
+        # add sys_data and disk_id
+        self.raw[0x000:0x200] = self.get_file_header()
+        # add ROM and RAM area
+        copy_blocks(self, disk, self.get_file_lbas(), threads)
 
-    def convert(self, disk):
-        if type(disk) is Disk_NDD or type(disk) is Disk_MAME:
+    def convert_info(self, disk) -> int:
+        """
+        Set disk information from the disk to convert, and return the size of the converted file.
+        """
+        if type(disk) is Disk_Cache: disk = disk.disk
+        if type(disk) is Disk_NDD or type(disk) is Disk_MAME or type(disk) is Disk_ZDD:
             # copy info
             self.sys_data = disk.sys_data
             self.disk_id = disk.disk_id
@@ -234,35 +326,36 @@ class Disk_D64:
 
             # remove disk unique information
             self.disk_id.remove_disk_unique_info()
-
-            # calculate D64 file size
-            size = 0x200
-            size += leo64dd.lba_to_byte(self.sys_data.disk_type, leo64dd.sys_lba_count, self.sys_data.rom_end_lba + 1)
-            if self.sys_data.is_ram_lba_info_present() == True:
-                size += leo64dd.lba_to_byte(self.sys_data.disk_type, leo64dd.sys_lba_count + self.sys_data.ram_start_lba, self.sys_data.ram_end_lba - self.sys_data.ram_start_lba + 1)
-
-            # make new raw data
-            self.raw = bytearray(size)
-            # add sys_data
-            self.raw[0x000:0x0E8] = self.sys_data.raw
-            # add disk_id
-            self.raw[0x100:0x1E8] = self.disk_id.raw
-            # add ROM area
-            for i in range(self.sys_data.rom_end_lba + 1):
-                position = self.get_lba_offset(leo64dd.sys_lba_count + i)
-                size = leo64dd.size_of_lba(disk.sys_data.disk_type, leo64dd.sys_lba_count + i)
-                self.raw[position:position+size] = disk.get_lba(leo64dd.sys_lba_count + i)
-            # add RAM area
-            if self.sys_data.is_ram_lba_info_present() == True:
-                for i in range(self.sys_data.ram_start_lba, self.sys_data.ram_end_lba + 1):
-                    position = self.get_lba_offset(leo64dd.sys_lba_count + i)
-                    size = leo64dd.size_of_lba(disk.sys_data.disk_type, leo64dd.sys_lba_count + i)
-                    self.raw[position:position+size] = disk.get_lba(leo64dd.sys_lba_count + i)
         elif type(disk) is Disk_D64:
             raise Exception("Converting with identical disk object.")
         else:
             raise Exception("Converting with unknown disk object.")
-            
+        self.sys_blocks = {}
+
+        # calculate D64 file size
+        size = 0x200
+        size += leo64dd.lba_to_byte(self.sys_data.disk_type, leo64dd.sys_lba_count, self.sys_data.rom_end_lba + 1)
+        if self.sys_data.is_ram_lba_info_present() == True:
+            size += leo64dd.lba_to_byte(self.sys_data.disk_type, leo64dd.sys_lba_count + self.sys_data.ram_start_lba, self.sys_data.ram_end_lba - self.sys_data.ram_start_lba + 1)
+        return size
+
+    def get_file_header(self) -> bytearray:
+        """
+        Returns the data stored before the blocks in the file. (System Data and Disk ID)
+        """
+        header = bytearray(0x200)
+        header[0x000:0x0E8] = self.sys_data.raw
+        header[0x100:0x1E8] = self.disk_id.raw
+        return header
+
+    def get_file_lbas(self) -> list:
+        """
+        Returns all LBAs stored in the file, in file order.
+        """
+        lbas = list(range(leo64dd.sys_lba_count, leo64dd.sys_lba_count + self.sys_data.rom_end_lba + 1))
+        if self.sys_data.is_ram_lba_info_present() == True:
+            lbas += range(leo64dd.sys_lba_count + self.sys_data.ram_start_lba, leo64dd.sys_lba_count + self.sys_data.ram_end_lba + 1)
+        return lbas
 
     def get_lba_offset(self, lba: int) -> int:
         if lba in leo64dd.sys_lba_tbl_retail:
@@ -287,11 +380,48 @@ class Disk_D64:
     
     def get_lba(self, lba: int, makesys=False) -> bytearray:
         offset = self.get_lba_offset(lba)
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("get_lba", leo64dd.size_of_lba(self.sys_data.disk_type, lba))
+        if offset == 0x000 or offset == 0x100:
+            return bytearray(self.get_sys_block(lba, makesys))
+        elif offset >= 0x200:
+            return self.raw[offset:offset+leo64dd.size_of_lba(self.sys_data.disk_type, lba)]
+        else:
+            return bytearray(leo64dd.size_of_lba(self.sys_data.disk_type, lba))
+
+    def get_lba_view(self, lba: int, writable=False, makesys=False) -> memoryview:
+        offset = self.get_lba_offset(lba)
+        if offset >= 0x200:
+            return get_block_view(self.raw, offset, leo64dd.size_of_lba(self.sys_data.disk_type, lba), writable)
+        # System Data, Disk ID and unallocated blocks are not stored as is in the file
+        if writable == True: raise Exception("Block is not stored in D64 file, it cannot be written to.")
+        if offset == 0x000 or offset == 0x100: return memoryview(self.get_sys_block(lba, makesys))
+        return memoryview(self.get_lba(lba, makesys)).toreadonly()
+
+    def iter_lbas(self, order="logical", start=0, end=leo64dd.lba_count, makesys=False):
+        return iter_lbas(self, order, start, end, makesys)
+
+    def get_sectors(self, lba: int, writable=False) -> numpy.ndarray:
+        return get_sectors(self, lba, writable)
+
+    def get_zone_sectors(self, pzone: int, writable=False) -> numpy.ndarray:
+        return get_zone_sectors(self, pzone, writable)
+
+    def boot_image(self, out=None, digest=None):
+        return get_boot_image(self, out, digest)
+
+    def get_sys_block(self, lba: int, makesys=False) -> bytes:
+        """
+        Returns System Data or Disk ID block made from D64 data. Each variant is only made once.
+        """
+        offset = self.get_lba_offset(lba)
+        key = (offset, makesys == True and lba in leo64dd.sys_lba_tbl_retail, makesys)
+        if key in self.sys_blocks: return self.sys_blocks[key]
+
         if offset == 0x000:
             data = bytearray(leo64dd.block_size_per_pzone[0])
             if self.development == False: secsize = 0xE8
             else: secsize = 0xC0
-            sector = self.raw[:secsize]
+            sector = bytearray(self.raw[:secsize])
             if makesys == True:
                 if lba in leo64dd.sys_lba_tbl_retail:
                     sector[0x00:0x04] = (0xE8, 0x48, 0xD3, 0x16)
@@ -302,57 +432,1611 @@ class Disk_D64:
                     sector[0xE6:0xE8] = (0xFF, 0xFF)
             for i in range(leo64dd.sector_count):
                 data[i*secsize:(i+1)*secsize] = sector
-            return data
         elif offset == 0x100:
             data = bytearray(leo64dd.block_size_per_pzone[0])
             secsize = 0xE8
             for i in range(leo64dd.sector_count):
                 data[i*secsize:(i+1)*secsize] = self.raw[0x100:0x100+secsize]
+        else:
+            raise ValueError()
+
+        self.sys_blocks[key] = bytes(data)
+        return self.sys_blocks[key]
+
+# Compressed NDD format class (all blocks in logical order, deduplicated and compressed by chunks)
+class Disk_ZDD:
+    chunk_size = 0x40000
+    zero_chunk = 0xFFFF
+    index_entry = ">HI"
+    chunk_entry = ">QIIBxxx"
+
+    def load(self, d: bytearray):
+        # check header of ZDD file
+        if len(d) < 0x200: raise Exception("Wrong size of ZDD file")
+        magic, version, development, chunk_count = struct.unpack(">4sBBxxI", d[0x000:0x00C])
+        if magic != b"LEOZ" or version != 1: raise Exception("This is not a ZDD file.")
+
+        # check system data
+        self.sys_data = leo64dd.Disk_Sys(d[0x010:0x0F8])
+        if self.sys_data.is_info_valid(d64=True) == False: raise Exception("Disk System Data is invalid.")
+        self.disk_id = leo64dd.Disk_Id(d[0x100:0x1E8])
+        self.development = development != 0
+
+        self.raw = d
+        self.read_index(chunk_count)
+
+    def read_index(self, chunk_count: int):
+        """
+        Read LBA index and chunk table from raw data.
+        """
+        index_size = struct.calcsize(self.index_entry) * leo64dd.lba_count
+        table_size = struct.calcsize(self.chunk_entry) * chunk_count
+        if len(self.raw) < 0x200 + index_size + table_size: raise Exception("Wrong size of ZDD file")
+        self.lba_index = list(struct.iter_unpack(self.index_entry, self.raw[0x200:0x200+index_size]))
+        self.chunks = list(struct.iter_unpack(self.chunk_entry, self.raw[0x200+index_size:0x200+index_size+table_size]))
+
+        for offset, stored_size, size, method in self.chunks:
+            if offset + stored_size > len(self.raw) or method > 1: raise Exception("Wrong ZDD chunk")
+        for i in range(leo64dd.lba_count):
+            chunk, offset = self.lba_index[i]
+            if chunk == self.zero_chunk: continue
+            if chunk >= chunk_count or offset + leo64dd.size_of_lba(self.sys_data.disk_type, i) > self.chunks[chunk][2]:
+                raise Exception("Wrong ZDD LBA index")
+
+        # a few decompressed chunks are kept for reads close to each other
+        self.chunk_cache = collections.OrderedDict()
+        self.chunk_lock = threading.Lock()
+
+    def convert(self, disk, threads=1, level=6):
+        self.convert_info(disk)
+
+        # keep each different block once, blocks filled with zeros are not stored
+        index = []
+        chunks = [[]]
+        chunk_sizes = [0]
+        found = {}
+        for i in range(leo64dd.lba_count):
+            view = get_source_lba_view(disk, i)
+            if numpy.frombuffer(view, dtype=numpy.uint8).any() == False:
+                index.append((self.zero_chunk, 0))
+                continue
+            data = bytes(view)
+            if data not in found:
+                if chunk_sizes[-1] >= self.chunk_size:
+                    chunks.append([])
+                    chunk_sizes.append(0)
+                found[data] = (len(chunks) - 1, chunk_sizes[-1])
+                chunks[-1].append(data)
+                chunk_sizes[-1] += len(data)
+            index.append(found[data])
+        if chunk_sizes[-1] == 0:
+            chunks.pop()
+            chunk_sizes.pop()
+
+        # chunks are compressed independently, zlib releases the GIL so they can be compressed at the same time
+        def compress(blocks):
+            data = b"".join(blocks)
+            packed = zlib.compress(data, level)
+            if len(packed) >= len(data): return data, 0
+            return packed, 1
+        with leo64dd.stats_stage("convert.compress"):
+            if threads > 1:
+                with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+                    packed = list(pool.map(compress, chunks))
+            else:
+                packed = [compress(blocks) for blocks in chunks]
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("compress", sum(chunk_sizes))
+
+        self.raw = self.get_file_header(len(packed))
+        for chunk, offset in index:
+            self.raw += struct.pack(self.index_entry, chunk, offset)
+        offset = len(self.raw) + struct.calcsize(self.chunk_entry) * len(packed)
+        for (data, method), size in zip(packed, chunk_sizes):
+            self.raw += struct.pack(self.chunk_entry, offset, len(data), size, method)
+            offset += len(data)
+        for data, method in packed:
+            self.raw += data
+        self.read_index(len(packed))
+
+    def convert_info(self, disk):
+        """
+        Set disk information from the disk to convert. (The size of the converted file is only known once compressed.)
+        """
+        if type(disk) is Disk_Cache: disk = disk.disk
+        if type(disk) is Disk_NDD or type(disk) is Disk_MAME or type(disk) is Disk_D64:
+            # set everything
+            self.sys_data = disk.sys_data
+            self.disk_id = disk.disk_id
+            self.development = disk.development
+        elif type(disk) is Disk_ZDD:
+            raise Exception("Converting with identical disk object.")
+        else:
+            raise Exception("Converting with unknown disk object.")
+        return 0
+
+    def get_file_header(self, chunk_count=0) -> bytearray:
+        """
+        Returns the data stored before the LBA index in the file. (System Data and Disk ID)
+        """
+        header = bytearray(0x200)
+        header[0x000:0x00C] = struct.pack(">4sBBxxI", b"LEOZ", 1, 1 if self.development == True else 0, chunk_count)
+        header[0x010:0x0F8] = self.sys_data.raw
+        header[0x100:0x1E8] = self.disk_id.raw
+        return header
+
+    def get_lba_offset(self, lba: int) -> int:
+        # blocks are not stored as is in the file
+        if lba < 0 or lba >= leo64dd.lba_count: raise ValueError()
+        return -1
+
+    def get_lba(self, lba: int) -> bytearray:
+        return bytearray(self.get_lba_view(lba))
+
+    def get_lba_view(self, lba: int, writable=False) -> memoryview:
+        if writable == True: raise Exception("Block is not stored as is in ZDD file, it cannot be written to.")
+        if lba < 0 or lba >= leo64dd.lba_count: raise ValueError()
+        chunk, offset = self.lba_index[lba]
+        size = leo64dd.size_of_lba(self.sys_data.disk_type, lba)
+        if chunk == self.zero_chunk: return memoryview(bytes(size))
+        return memoryview(self.get_chunk(chunk))[offset:offset+size]
+
+    def iter_lbas(self, order="logical", start=0, end=leo64dd.lba_count):
+        return iter_lbas(self, order, start, end)
+
+    def get_sectors(self, lba: int, writable=False) -> numpy.ndarray:
+        return get_sectors(self, lba, writable)
+
+    def get_zone_sectors(self, pzone: int, writable=False) -> numpy.ndarray:
+        return get_zone_sectors(self, pzone, writable)
+
+    def boot_image(self, out=None, digest=None):
+        return get_boot_image(self, out, digest)
+
+    def get_chunk(self, chunk: int) -> bytes:
+        """
+        Returns decompressed chunk data, from the last used chunks if possible.
+        """
+        with self.chunk_lock:
+            data = self.chunk_cache.get(chunk)
+            if data is not None:
+                self.chunk_cache.move_to_end(chunk)
+                return data
+
+        offset, stored_size, size, method = self.chunks[chunk]
+        data = bytes(get_block_view(self.raw, offset, stored_size))
+        if method == 1: data = zlib.decompress(data)
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("decompress", size)
+        if len(data) != size: raise Exception("Wrong ZDD chunk")
+
+        with self.chunk_lock:
+            self.chunk_cache[chunk] = data
+            while len(self.chunk_cache) > 8: self.chunk_cache.popitem(last=False)
+        return data
+
+# LRU block cache in front of any disk class
+class Disk_Cache:
+    def __init__(self, disk, max_size=0x1000000):
+        self.disk = disk
+        self.max_size = max_size
+        self.size = 0
+        self.blocks = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getattr__(self, name):
+        # everything else (sys_data, disk_id, development, get_lba_offset...) comes from the disk class
+        return getattr(self.disk, name)
+
+    def get_lba_view(self, lba: int, writable=False, makesys=False) -> memoryview:
+        """
+        Returns a read-only view of the block, from the cache if possible.
+        If writable is True, the cache is bypassed: the block is removed from the cache and the view of the disk class is returned.
+        """
+        if writable == True:
+            self.drop_lba(lba)
+            if makesys == True and type(self.disk) is Disk_D64: return self.disk.get_lba_view(lba, writable=True, makesys=True)
+            return self.disk.get_lba_view(lba, writable=True)
+
+        # makesys only changes Disk_D64 blocks
+        key = (lba, makesys == True and type(self.disk) is Disk_D64)
+        with self.lock:
+            data = self.blocks.get(key)
+            if data is not None:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return memoryview(data)
+            self.misses += 1
+
+        if key[1] == True: data = bytes(self.disk.get_lba_view(lba, makesys=True))
+        else: data = bytes(self.disk.get_lba_view(lba))
+        if len(data) > self.max_size: return memoryview(data)
+
+        with self.lock:
+            if key not in self.blocks:
+                self.blocks[key] = data
+                self.size += len(data)
+            # remove least recently used blocks until under the limit
+            while self.size > self.max_size:
+                old_key, old_data = self.blocks.popitem(last=False)
+                self.size -= len(old_data)
+                self.evictions += 1
+        return memoryview(data)
+
+    def get_lba(self, lba: int, makesys=False) -> bytearray:
+        """
+        Returns a copy of the block, from the cache if possible.
+        """
+        return bytearray(self.get_lba_view(lba, makesys=makesys))
+
+    def iter_lbas(self, order="logical", start=0, end=leo64dd.lba_count, makesys=False):
+        """
+        Yields (lba, memoryview) of the blocks from start to end (not included), from the cache if possible.
+        """
+        return iter_lbas(self, order, start, end, makesys)
+
+    def get_sectors(self, lba: int, writable=False) -> numpy.ndarray:
+        """
+        Returns the sectors of the block as a (85, sector size) numpy array, from the cache if possible.
+        The array is read-only unless writable is True (the cache is then bypassed, see get_lba_view).
+        """
+        return get_sectors(self, lba, writable)
+
+    def get_zone_sectors(self, pzone: int, writable=False) -> numpy.ndarray:
+        """
+        Returns the sectors of all blocks of a Physical Zone as a (blocks, 85, sector size) numpy array.
+        If writable is True, the blocks of the zone are removed from the cache and the array views the disk data.
+        """
+        if writable == True:
+            for i in leo64dd.pzone_to_lbas(self.disk.sys_data.disk_type, pzone): self.drop_lba(i)
+            return get_zone_sectors(self.disk, pzone, True)
+        return get_zone_sectors(self, pzone)
+
+    def put_lba(self, lba: int, data):
+        put_block(self, lba, data)
+
+    def put_sector(self, lba: int, sector: int, data):
+        put_block(self, lba, data, sector)
+
+    def boot_image(self, out=None, digest=None):
+        """
+        Returns the IPL data of the disk (see get_boot_image).
+        """
+        return get_boot_image(self, out, digest)
+
+    def get_stats(self) -> dict:
+        """
+        Returns cache counters: "hits", "misses", "evictions", "blocks" and "size" (bytes).
+        """
+        with self.lock:
+            return { "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "blocks": len(self.blocks), "size": self.size }
+
+    def drop_lba(self, lba: int):
+        """
+        Remove a block from the cache.
+        """
+        with self.lock:
+            for key in ((lba, False), (lba, True)):
+                data = self.blocks.pop(key, None)
+                if data is not None: self.size -= len(data)
+
+    def clear(self):
+        """
+        Remove all blocks from the cache. (Needed if the disk data changes without put_lba or put_sector.)
+        """
+        with self.lock:
+            self.blocks.clear()
+            self.size = 0
+
+# file backed raw data, read on demand
+class Disk_FileData:
+    def __init__(self, path: str):
+        # set first so close() works even if the file cannot be opened
+        self.fd = -1
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self.size = os.fstat(self.fd).st_size
+        # only used where positioned reads are not available
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key):
+        if type(key) is slice:
+            start, stop, step = key.indices(self.size)
+            if step != 1: raise ValueError("Step is not supported")
+            return self.read(start, stop - start)
+        if key < 0: key += self.size
+        if key < 0 or key >= self.size: raise IndexError()
+        return self.read(key, 1)[0]
+
+    def read(self, offset: int, size: int) -> bytes:
+        """
+        Read size bytes at offset from the file. (Less if the end of file is reached.)
+        """
+        size = min(size, self.size - offset)
+        if size <= 0: return bytes()
+        if leo64dd.stats is not None:
+            leo64dd.add_stats_call("file.read")
+            leo64dd.add_stats_bytes("file.read", size)
+        if hasattr(os, "pread"):
+            data = os.pread(self.fd, size, offset)
+            # positioned reads can return less than asked
+            while len(data) < size:
+                chunk = os.pread(self.fd, size - len(data), offset + len(data))
+                if len(chunk) == 0: break
+                data += chunk
             return data
-        elif offset >= 0x200:
-            return self.raw[offset:][:leo64dd.size_of_lba(self.sys_data.disk_type, lba)]
+        with self.lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            data = os.read(self.fd, size)
+            while len(data) < size:
+                chunk = os.read(self.fd, size - len(data))
+                if len(chunk) == 0: break
+                data += chunk
+            return data
+
+    def close(self):
+        """
+        Close the file.
+        """
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __del__(self):
+        self.close()
+
+# stream backed raw data (for example while decompressing), can only be read forward
+class Disk_StreamData:
+    def __init__(self, stream, size: int, window=0x100000):
+        self.stream = stream
+        self.size = size
+        # data from start is kept in buffer, at most window bytes before the last read
+        self.window = window
+        self.start = 0
+        self.buffer = bytearray()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, key):
+        if type(key) is slice:
+            start, stop, step = key.indices(self.size)
+            if step != 1: raise ValueError("Step is not supported")
+            return self.read(start, stop - start)
+        if key < 0: key += self.size
+        if key < 0 or key >= self.size: raise IndexError()
+        return self.read(key, 1)[0]
+
+    def read(self, offset: int, size: int) -> bytes:
+        """
+        Read size bytes at offset from the stream. (Less if the end of data is reached.)
+        Data too far before the last read is not kept, reading it again raises an exception.
+        """
+        size = min(size, self.size - offset)
+        if size <= 0: return bytes()
+        if offset < self.start: raise Exception("Disk data can only be read forward from this stream.")
+        while self.start + len(self.buffer) < offset + size:
+            chunk = self.stream.read(max(offset + size - self.start - len(self.buffer), 0x10000))
+            if len(chunk) == 0: raise Exception("Disk data stream ended too soon.")
+            self.buffer += chunk
+        data = bytes(self.buffer[offset - self.start:offset - self.start + size])
+        drop = offset - self.window - self.start
+        if drop > 0:
+            del self.buffer[:drop]
+            self.start += drop
+        if leo64dd.stats is not None:
+            leo64dd.add_stats_call("stream.read")
+            leo64dd.add_stats_bytes("stream.read", size)
+        return data
+
+    def close(self):
+        """
+        Close the stream (and the compressed file).
+        """
+        self.stream.close()
+        self.buffer = bytearray()
+
+def open_compressed_file_check(path: str) -> bool:
+    """
+    Returns True if the file is compressed in a format read by open_compressed_file.
+    """
+    with open(path, "rb") as infile:
+        magic = infile.read(6)
+    return magic[:2] == b"\x1F\x8B" or magic == b"\xFD7zXZ\x00" or magic[:3] == b"BZh" or magic[:4] == b"PK\x03\x04"
+
+def open_compressed_file(path: str) -> tuple:
+    """
+    Open a compressed file (gzip, xz, bz2 or zip with the disk file as first file) for reading.
+    Returns (stream, uncompressed size or None if not known without decompressing), or None if the file is not compressed.
+    """
+    with open(path, "rb") as infile:
+        magic = infile.read(6)
+        if magic[:2] == b"\x1F\x8B":
+            # size (modulo 4 GB) is stored at the end of gzip files
+            infile.seek(-4, os.SEEK_END)
+            return gzip.open(path, "rb"), struct.unpack("<I", infile.read(4))[0]
+        elif magic == b"\xFD7zXZ\x00":
+            return lzma.open(path, "rb"), get_xz_size(infile)
+        elif magic[:3] == b"BZh":
+            return bz2.open(path, "rb"), None
+        elif magic[:4] == b"PK\x03\x04":
+            with zipfile.ZipFile(path) as archive:
+                # the file stays open until the stream is closed
+                for info in archive.infolist():
+                    if info.is_dir() == False: return archive.open(info), info.file_size
+            raise Exception("Zip file is empty.")
+    return None
+
+def get_xz_size(infile) -> int:
+    """
+    Returns the uncompressed size of a xz file (with a single stream) from its index, or None if it cannot be read.
+    """
+    def read_number(d, offset):
+        value = 0
+        for i in range(9):
+            if offset >= len(d): return None, offset
+            value |= (d[offset] & 0x7F) << (i * 7)
+            offset += 1
+            if d[offset - 1] & 0x80 == 0: return value, offset
+        return None, offset
+
+    file_size = infile.seek(0, os.SEEK_END)
+    if file_size < 24: return None
+    infile.seek(file_size - 12)
+    footer = infile.read(12)
+    if footer[10:12] != b"YZ": return None
+    index_size = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+    if index_size > file_size - 24: return None
+    infile.seek(file_size - 12 - index_size)
+    d = infile.read(index_size)
+    if d[0] != 0x00: return None
+    count, offset = read_number(d, 1)
+    if count is None: return None
+    size = 0
+    for i in range(count):
+        unpadded, offset = read_number(d, offset)
+        uncompressed, offset = read_number(d, offset)
+        if unpadded is None or uncompressed is None: return None
+        size += uncompressed
+    return size
+
+def spill_stream(stream, size=None, max_memory=0x4000000):
+    """
+    Read a whole stream in memory if it fits in max_memory bytes, else into a temporary file that is memory-mapped.
+    size is the expected size if known, to go to the temporary file directly if too big.
+    Returns the data (bytearray or mmap).
+    """
+    d = bytearray()
+    while len(d) <= max_memory and (size is None or size <= max_memory):
+        chunk = stream.read(0x100000)
+        if len(chunk) == 0: return d
+        d += chunk
+    # too big, the rest goes to a temporary file (removed once not used anymore)
+    with tempfile.TemporaryFile() as tmp:
+        tmp.write(d)
+        del d
+        shutil.copyfileobj(stream, tmp, 0x100000)
+        tmp.flush()
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("spill", tmp.tell())
+        return mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ)
+
+def open_compressed_disk_file(path: str, stream=False, max_memory=0x4000000, verbose=True):
+    """
+    Open a compressed disk file (see open_compressed_file) and return fully loaded disk class.
+    If stream is True and the disk file is NDD or D64 (blocks in LBA order) of known size, blocks are decompressed
+    as they are read (Disk_StreamData), so blocks can only be read in LBA order. The compressed file is then kept open
+    until closed with close_disk_file.
+    Otherwise the whole disk file is decompressed in memory up to max_memory bytes, or in a temporary file.
+    """
+    compressed = open_compressed_file(path)
+    if compressed is None: raise Exception("This is not a compressed file.")
+    infile, size = compressed
+    if stream == True and size is not None:
+        data = Disk_StreamData(infile, size)
+        fmt = basic_disk_file_check(data)
+        if fmt == "ndd" or fmt == "d64":
+            try:
+                return load_disk_file(data, verbose)
+            except Exception:
+                # the size may be wrong (gzip only stores the size of its last member), check the whole data instead
+                pass
+        # needs random access, start again from the beginning
+        data.close()
+        infile, size = open_compressed_file(path)
+    with infile:
+        return load_disk_file(spill_stream(infile, size, max_memory), verbose)
+
+def close_disk_file(disk):
+    """
+    Close the file data of a disk class (memory-map, Disk_FileData or Disk_StreamData) instead of waiting for it to be
+    garbage collected. Blocks cannot be read anymore.
+    """
+    close = getattr(disk.raw, "close", None)
+    if close is None: return
+    try:
+        close()
+    except BufferError:
+        # still viewed somewhere, closed once not used anymore
+        pass
+
+def byte_offset_to_lba(disk, offset: int) -> int:
+    """
+    Returns the LBA of the block stored at the given file offset of disk, or -1 if no block is stored as is there
+    (file header, unused space, or any offset of a ZDD file).
+    """
+    layout = leo64dd.get_layout(disk.sys_data.disk_type)
+    if type(disk) is Disk_NDD:
+        if offset < 0 or offset >= layout.offset[leo64dd.lba_count]: return -1
+        return leo64dd.byte_offset_to_lba(disk.sys_data.disk_type, offset)
+    elif type(disk) is Disk_MAME:
+        return disk.sys_data.get_phys_map().offset_to_lba(offset)
+    elif type(disk) is Disk_D64:
+        # ROM Area then RAM Area, each stored in LBA order
+        areas = [(leo64dd.sys_lba_count, leo64dd.sys_lba_count + disk.sys_data.rom_end_lba + 1)]
+        if disk.sys_data.is_ram_lba_info_present() == True:
+            areas.append((leo64dd.sys_lba_count + disk.sys_data.ram_start_lba, leo64dd.sys_lba_count + disk.sys_data.ram_end_lba + 1))
+        start = 0x200
+        for first, end in areas:
+            size = layout.offset[end] - layout.offset[first]
+            if offset >= start and offset < start + size:
+                return bisect.bisect_right(layout.offset, offset - start + layout.offset[first]) - 1
+            start += size
+        return -1
+    elif type(disk) is Disk_ZDD:
+        return -1
+    raise Exception("Unknown disk object.")
+
+def get_block_view(d, offset: int, size: int, writable=False) -> memoryview:
+    """
+    Returns a memoryview of size bytes at offset of the given buffer without copying any data.
+    The view is read-only unless writable is True.
+    (With Disk_FileData, the data is read from the file, and it can only be read-only.)
+    """
+    if type(d) is Disk_FileData or type(d) is Disk_StreamData:
+        if writable == True: raise Exception("Disk data is read-only.")
+        return memoryview(d.read(offset, size))
+    view = memoryview(d)[offset:offset+size]
+    if writable == False: return view.toreadonly()
+    if view.readonly == True: raise Exception("Disk data is read-only.")
+    return view
+
+def get_source_lba_view(disk, lba: int) -> memoryview:
+    """
+    Returns the block view of a disk to convert from. (D64 System Data is made to look like a Retail disk.)
+    """
+    inner = disk.disk if type(disk) is Disk_Cache else disk
+    if type(inner) is Disk_D64: return disk.get_lba_view(lba, makesys=True)
+    return disk.get_lba_view(lba)
+
+def get_storage_lbas(disk, start=0, end=leo64dd.lba_count) -> list:
+    """
+    Returns LBAs from start to end (not included) in the order their data is stored in the file of the disk class.
+    LBAs not stored as is in the file (D64 System Data, Disk ID and unallocated blocks) come first.
+    ZDD blocks are in chunk order (each chunk is decompressed once), blocks filled with zeros come last.
+    """
+    if start < 0 or end > leo64dd.lba_count or start > end: raise ValueError()
+    inner = disk.disk if type(disk) is Disk_Cache else disk
+    if type(inner) is Disk_ZDD:
+        return sorted(range(start, end), key=inner.lba_index.__getitem__)
+    lbas = [i for i in inner.get_file_lbas() if i >= start and i < end]
+    stored = set(lbas)
+    return [i for i in range(start, end) if i not in stored] + lbas
+
+def iter_lbas(disk, order="logical", start=0, end=leo64dd.lba_count, makesys=False):
+    """
+    Returns an iterator of (lba, memoryview) of the blocks from start to end (not included) of any disk class.
+    Wrong arguments raise ValueError right away, blocks are only read when iterated.
+    order = "logical" (LBA order)
+          = "storage" (file order, see get_storage_lbas, so the file is read sequentially)
+    If makesys is True, D64 System Data is made to look like a Retail disk. (see get_source_lba_view)
+    """
+    if order == "logical":
+        if start < 0 or end > leo64dd.lba_count or start > end: raise ValueError()
+        lbas = range(start, end)
+    elif order == "storage":
+        lbas = get_storage_lbas(disk, start, end)
+    else:
+        raise ValueError(f"Unknown \"{order}\" order")
+
+    # arguments are checked when called, blocks are read when iterated
+    def iterate():
+        for i in lbas:
+            if makesys == True: yield i, disk.get_lba_view(i, makesys=True)
+            else: yield i, disk.get_lba_view(i)
+    return iterate()
+
+def get_sectors(disk, lba: int, writable=False) -> numpy.ndarray:
+    """
+    Returns the sectors of a block of any disk class as a (85, sector size) numpy array viewing the block data
+    without copying it (see get_lba_view). The array is read-only unless writable is True.
+    """
+    if writable == True: view = disk.get_lba_view(lba, writable=True)
+    else: view = disk.get_lba_view(lba)
+    secsize = leo64dd.size_of_sectors(disk.sys_data.disk_type, lba)
+    return numpy.frombuffer(view, dtype=numpy.uint8).reshape(leo64dd.sector_count, secsize)
+
+def get_zone_sectors(disk, pzone: int, writable=False) -> numpy.ndarray:
+    """
+    Returns the sectors of all blocks of a Physical Zone of any disk class as a (blocks, 85, sector size) numpy array, in LBA order.
+    If the blocks are stored one after another in LBA order (NDD), the array views the data without copying it,
+    and it is read-only unless writable is True. Else the blocks are copied into a read-only array, and writable must be False.
+    """
+    t = disk.sys_data.disk_type
+    lbas = leo64dd.pzone_to_lbas(t, pzone)
+    size = leo64dd.size_of_lba(t, lbas.start)
+    shape = (len(lbas), leo64dd.sector_count, size // leo64dd.sector_count)
+
+    offsets = get_lba_offset_array(disk)
+    if offsets is not None:
+        offsets = offsets[lbas.start:lbas.stop]
+        base = int(offsets.min())
+        rows, rest = numpy.divmod(offsets - base, size)
+        if numpy.any(rest) == False:
+            count = int(rows.max()) + 1
+            d = numpy.frombuffer(get_block_view(disk.raw, base, count * size, writable), dtype=numpy.uint8)
+            if numpy.array_equal(rows, numpy.arange(len(lbas))): return d.reshape(shape)
+            if writable == False:
+                # gather blocks of the zone (MAME) in one numpy copy
+                sectors = d.reshape(count, shape[1], shape[2])[rows]
+                sectors.flags.writeable = False
+                return sectors
+
+    if writable == True: raise Exception("Blocks of this zone are not stored in LBA order, they cannot be written to.")
+    sectors = numpy.empty(shape, dtype=numpy.uint8)
+    for row, i in enumerate(lbas):
+        sectors[row] = get_sectors(disk, i)
+    sectors.flags.writeable = False
+    return sectors
+
+def scan_sys_blocks(d) -> dict:
+    """
+    Checks all System Data and Disk ID block copies of NDD or MAME file data at once.
+    Returns a dict with "retail", "dev" and "diskid" entries, each a dict of LBA to True if the copy is good (all sectors identical).
+    """
+    # all of these blocks are in the first zone, at the same place for all disk types in both NDD and MAME formats
+    count = max(leo64dd.sys_lba_tbl_retail + leo64dd.sys_lba_tbl_dev + leo64dd.sys_lba_tbl_diskid) + 1
+    size = leo64dd.block_size_per_pzone[0]
+    if len(d) < count * size: raise Exception("Disk data is too small")
+    with leo64dd.stats_stage("load.scan_sys_blocks"):
+        blocks = numpy.frombuffer(get_block_view(d, 0, count * size), dtype=numpy.uint8).reshape(count, size)
+
+        good = {}
+        for name, lbas, secsize in (("retail", leo64dd.sys_lba_tbl_retail, 0xE8), ("dev", leo64dd.sys_lba_tbl_dev, 0xC0), ("diskid", leo64dd.sys_lba_tbl_diskid, 0xE8)):
+            result = leo64dd.verify_sec_repeat_blocks(blocks[list(lbas)], secsize)
+            good[name] = dict(zip(lbas, result.tolist()))
+    return good
+
+def get_lba_offset_array(disk) -> numpy.ndarray:
+    """
+    Returns the file offsets of all LBAs as a numpy array, or None if the disk class does not store every block as is in the file.
+    """
+    if type(disk) is Disk_Cache: disk = disk.disk
+    if type(disk) is Disk_NDD:
+        return numpy.array(leo64dd.get_layout(disk.sys_data.disk_type).offset[:leo64dd.lba_count], dtype=numpy.int64)
+    elif type(disk) is Disk_MAME:
+        return numpy.frombuffer(disk.sys_data.get_phys_map().offset, dtype=numpy.uint32).astype(numpy.int64)
+    return None
+
+def get_convert_plan(after, disk) -> list:
+    """
+    Returns the block copies needed to convert disk to the format of after, one per Virtual Zone, as a list of
+    (block size, source offset, source rows, destination offset, destination rows). Rows are block indexes from
+    the offsets, either a slice if contiguous or a numpy array.
+    Returns None if the conversion cannot be done this way.
+    """
+    src = get_lba_offset_array(disk)
+    dst = get_lba_offset_array(after)
+    if src is None or dst is None: return None
+
+    layout = leo64dd.get_layout(disk.sys_data.disk_type)
+    plan = []
+    start = 0
+    for end in leo64dd.vzone_lba_tbl[disk.sys_data.disk_type]:
+        # all blocks of a zone have the same size
+        size = layout.size[start]
+        entry = [size]
+        for offsets in (src[start:end], dst[start:end]):
+            base = int(offsets.min())
+            rows, rest = numpy.divmod(offsets - base, size)
+            if numpy.any(rest): return None
+            if numpy.array_equal(rows, numpy.arange(rows[0], rows[0] + len(rows))):
+                rows = slice(int(rows[0]), int(rows[0]) + len(rows))
+            entry += [base, rows]
+        plan.append(tuple(entry))
+        start = end
+    return plan
+
+def get_zone_rows(d: numpy.ndarray, offset: int, rows, size: int) -> numpy.ndarray:
+    """
+    Returns a 2D view of blocks of given size from offset, up to the last row used.
+    """
+    if type(rows) is slice: count = rows.stop
+    else: count = int(rows.max()) + 1
+    return d[offset:offset + count * size].reshape(count, size)
+
+def convert_blocks(after, disk, threads=1) -> bool:
+    """
+    Copy all blocks of disk to after.raw with a few bulk numpy copies, one per zone, split over threads if more than 1.
+    Returns False if it could not be done, in which case blocks have to be copied one by one.
+    """
+    plan = get_convert_plan(after, disk)
+    if plan is None: return False
+    try:
+        src = numpy.frombuffer(disk.raw, dtype=numpy.uint8)
+        dst = numpy.frombuffer(after.raw, dtype=numpy.uint8)
+    except (TypeError, ValueError):
+        return False
+    if dst.flags.writeable == False: return False
+
+    def copy_zone(entry):
+        size, src_offset, src_rows, dst_offset, dst_rows = entry
+        src_zone = get_zone_rows(src, src_offset, src_rows, size)
+        dst_zone = get_zone_rows(dst, dst_offset, dst_rows, size)
+        if type(dst_rows) is slice and type(src_rows) is not slice:
+            # gather directly into destination without temporary copy
+            numpy.take(src_zone, src_rows, axis=0, out=dst_zone[dst_rows])
         else:
-            return bytearray(leo64dd.size_of_lba(self.sys_data.disk_type, lba))
+            dst_zone[dst_rows] = src_zone[src_rows]
+
+    # zones never overlap, numpy copies release the GIL so they can run at the same time
+    with leo64dd.stats_stage("convert.bulk_copy"):
+        if threads > 1:
+            with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+                list(pool.map(copy_zone, plan))
+        else:
+            for entry in plan: copy_zone(entry)
+    if leo64dd.stats is not None: leo64dd.add_stats_bytes("copy", leo64dd.get_layout(disk.sys_data.disk_type).offset[leo64dd.lba_count])
+    return True
+
+def copy_blocks(after, disk, lbas: list, threads=1):
+    """
+    Copy given LBAs of disk to after.raw block by block, in the storage order of disk so its file is read sequentially.
+    If threads is more than 1, LBAs are split in ranges copied by each thread with numpy copies.
+    """
+    rank = { lba: i for i, lba in enumerate(get_storage_lbas(disk)) }
+    lbas = sorted(lbas, key=rank.__getitem__)
+    if leo64dd.stats is not None:
+        leo64dd.add_stats_bytes("copy", sum([leo64dd.size_of_lba(disk.sys_data.disk_type, i) for i in lbas]))
+    with leo64dd.stats_stage("convert.block_copy"):
+        if threads <= 1:
+            for i in lbas:
+                position = after.get_lba_offset(i)
+                size = leo64dd.size_of_lba(disk.sys_data.disk_type, i)
+                after.raw[position:position+size] = get_source_lba_view(disk, i)
+            return
+
+        dst = numpy.frombuffer(after.raw, dtype=numpy.uint8)
+        def copy_range(lbas):
+            for i in lbas:
+                position = after.get_lba_offset(i)
+                size = leo64dd.size_of_lba(disk.sys_data.disk_type, i)
+                dst[position:position+size] = numpy.frombuffer(get_source_lba_view(disk, i), dtype=numpy.uint8)
+
+        step = -(-len(lbas) // threads)
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            list(pool.map(copy_range, [lbas[i:i+step] for i in range(0, len(lbas), step)]))
+
+def put_block(disk, lba: int, data, sector=-1, count=1):
+    """
+    Write data to a block of disk (or to count sectors of it from sector if sector is not -1), and mark it as changed for flush_disk.
+    """
+    if lba < 0 or lba >= leo64dd.lba_count: raise ValueError()
+    if type(disk) is Disk_Cache:
+        # write to the disk class, then remove the old block from the cache
+        put_block(disk.disk, lba, data, sector, count)
+        disk.drop_lba(lba)
+        return
+    if sector == -1:
+        start = 0
+        size = leo64dd.size_of_lba(disk.sys_data.disk_type, lba)
+        if len(data) != size: raise Exception("Wrong size of block data")
+    else:
+        if sector < 0 or count < 1 or sector + count > leo64dd.sector_count: raise ValueError()
+        start = sector * leo64dd.size_of_sectors(disk.sys_data.disk_type, lba)
+        size = count * leo64dd.size_of_sectors(disk.sys_data.disk_type, lba)
+        if len(data) != size: raise Exception("Wrong size of sector data")
+
+    disk.get_lba_view(lba, writable=True)[start:start+size] = data
+    offset = disk.get_lba_offset(lba) + start
+    disk.dirty[offset] = max(disk.dirty.get(offset, 0), size)
+
+def get_dirty_ranges(disk) -> list:
+    """
+    Returns the changed ranges of the raw data of disk as a sorted list of (offset, size), next ranges being merged.
+    """
+    ranges = []
+    for offset in sorted(disk.dirty):
+        end = offset + disk.dirty[offset]
+        if len(ranges) != 0 and offset <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([offset, end])
+    return [(start, end - start) for start, end in ranges]
+
+def flush_disk(disk, out=None, fsync=False) -> int:
+    """
+    Write only the changed ranges of disk to its file.
+    out is either a path or a file object opened for writing (without truncating) of the same disk file,
+    or None if the raw data is a writable memory-map of the file (already written to the file, only synced if fsync is True).
+    A copy-on-write memory-map (open_disk_file mode "c") is not written to the file, out must be given.
+    If fsync is True, changes are forced to the storage before returning.
+    Returns the amount of bytes written.
+    """
+    if isinstance(out, (str, bytes, os.PathLike)):
+        with open(out, "r+b") as outfile:
+            return flush_disk(disk, outfile, fsync)
+
+    ranges = get_dirty_ranges(disk)
+    if out is None:
+        if type(disk.raw) is not mmap.mmap: raise Exception("Disk data is not a file, give a file to write to.")
+        if getattr(disk, "mmap_access", mmap.ACCESS_WRITE) == mmap.ACCESS_COPY:
+            raise Exception("Disk data is a copy of the file, give a file to write to.")
+        if fsync == True:
+            for offset, size in ranges:
+                # memory-map flush offset must be aligned
+                start = offset - offset % mmap.ALLOCATIONGRANULARITY
+                disk.raw.flush(start, offset + size - start)
+    else:
+        for offset, size in ranges:
+            out.seek(offset)
+            out.write(get_block_view(disk.raw, offset, size))
+        out.flush()
+        if fsync == True: os.fsync(out.fileno())
+    disk.dirty.clear()
+    return sum([size for offset, size in ranges])
+
+lba_hash_size = 16
+lba_hash_header = ">4sBBBxH"
+
+def get_lba_hashes(disk, threads=1, skip_zero=False) -> list:
+    """
+    Returns the hash (BLAKE2b, 16 bytes) of every LBA block in logical order. Hashes only depend on the block data,
+    so they are the same for NDD and MAME files of the same disk. Blocks are hashed over several threads if threads is more than 1.
+    If skip_zero is True, blocks filled with zeros are not hashed, the hash of a zero block is used instead (same result).
+    Blocks are read in storage order (see get_storage_lbas), so the file is read sequentially.
+    """
+    zero_hashes = {}
+    if leo64dd.stats is not None: leo64dd.add_stats_bytes("hash", leo64dd.get_layout(disk.sys_data.disk_type).offset[leo64dd.lba_count])
+    def hash_range(lbas):
+        hashes = []
+        for i in lbas:
+            view = disk.get_lba_view(i)
+            if skip_zero == True and numpy.frombuffer(view, dtype=numpy.uint8).any() == False:
+                if len(view) not in zero_hashes:
+                    zero_hashes[len(view)] = hashlib.blake2b(bytes(len(view)), digest_size=lba_hash_size).digest()
+                hashes.append(zero_hashes[len(view)])
+            else:
+                hashes.append(hashlib.blake2b(view, digest_size=lba_hash_size).digest())
+        return hashes
+
+    lbas = get_storage_lbas(disk)
+    if threads <= 1:
+        found = hash_range(lbas)
+    else:
+        # hashlib releases the GIL while hashing blocks
+        step = -(-len(lbas) // threads)
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            found = sum(pool.map(hash_range, [lbas[i:i+step] for i in range(0, len(lbas), step)]), [])
+    # back to logical order
+    hashes = [None] * leo64dd.lba_count
+    for i, h in zip(lbas, found): hashes[i] = h
+    return hashes
+
+def get_disk_digest(disk, threads=1, skip_zero=False) -> str:
+    """
+    Returns a single hex digest of all LBA blocks of the disk, the same for NDD and MAME files of the same disk.
+    """
+    return get_lba_hashes_digest(get_lba_hashes(disk, threads, skip_zero))
+
+def get_lba_hashes_digest(hashes: list) -> str:
+    """
+    Returns the disk digest from the LBA hashes given by get_lba_hashes.
+    """
+    return hashlib.blake2b(b"".join(hashes), digest_size=32).hexdigest()
+
+def save_lba_hashes(path: str, disk_type: int, hashes: list):
+    """
+    Save LBA hashes to a compact index file. (Header, then all hashes in LBA order.)
+    """
+    with open(path, "wb") as outfile:
+        outfile.write(struct.pack(lba_hash_header, b"LEOH", 1, disk_type, lba_hash_size, len(hashes)))
+        outfile.write(b"".join(hashes))
+
+def load_lba_hashes(path: str) -> tuple:
+    """
+    Load LBA hashes from an index file made with save_lba_hashes. Returns (disk type, list of hashes).
+    """
+    with open(path, "rb") as infile:
+        d = infile.read()
+    start = struct.calcsize(lba_hash_header)
+    if len(d) < start: raise Exception("Wrong size of LBA hash file")
+    magic, version, disk_type, size, count = struct.unpack(lba_hash_header, d[:start])
+    if magic != b"LEOH" or version != 1: raise Exception("This is not a LBA hash file.")
+    if len(d) != start + size * count: raise Exception("Wrong size of LBA hash file")
+    return disk_type, [d[start+i*size:start+(i+1)*size] for i in range(count)]
+
+# IPL data of the last booted disks by digest
+boot_image_cache = collections.OrderedDict()
+boot_image_cache_count = 16
+boot_image_lock = threading.Lock()
+
+def get_boot_image(disk, out=None, digest=None):
+    """
+    Returns the IPL data of any disk class: ipl_load_size blocks from LBA 24, loaded at ipl_load_addr when booting.
+    It is read with a single copy if the blocks are stored one after another in the file, else all blocks are joined at once.
+    If out is given (writable buffer, at least as big), the IPL data is written to it instead, and its size is returned.
+    If digest is given (for example from get_disk_digest or a catalog), the IPL data is kept for the next disks with the same digest.
+    """
+    if digest is not None:
+        with boot_image_lock:
+            data = boot_image_cache.get(digest)
+            if data is not None: boot_image_cache.move_to_end(digest)
+        if data is not None:
+            if leo64dd.stats is not None: leo64dd.add_stats_call("boot_image.cache")
+            if out is None: return data
+            if len(out) < len(data): raise Exception("Wrong size of output buffer")
+            memoryview(out)[:len(data)] = data
+            return len(data)
+
+    t = disk.sys_data.disk_type
+    count = disk.sys_data.ipl_load_size
+    start = leo64dd.sys_lba_count
+    if start + count > leo64dd.lba_count: raise Exception("IPL is bigger than the disk.")
+    size = leo64dd.lba_to_byte(t, start, count)
+    if out is not None and len(out) < size: raise Exception("Wrong size of output buffer")
+    if leo64dd.stats is not None: leo64dd.add_stats_bytes("boot_image", size)
+
+    # single view if the blocks are stored one after another in the file
+    offset = disk.get_lba_offset(start) if count != 0 else -1
+    position = offset
+    for i in range(start, start + count):
+        if offset < 0 or disk.get_lba_offset(i) != position:
+            offset = -1
+            break
+        position += leo64dd.size_of_lba(t, i)
+    if offset >= 0:
+        views = [get_block_view(disk.raw, offset, size)]
+    else:
+        views = [disk.get_lba_view(i) for i in range(start, start + count)]
+
+    if out is not None and digest is None:
+        position = 0
+        for view in views:
+            memoryview(out)[position:position + len(view)] = view
+            position += len(view)
+        return size
+
+    data = b"".join(views)
+    if digest is not None:
+        with boot_image_lock:
+            boot_image_cache[digest] = data
+            while len(boot_image_cache) > boot_image_cache_count: boot_image_cache.popitem(last=False)
+    if out is None: return data
+    memoryview(out)[:size] = data
+    return size
+
+patch_header = ">4sBBxxI"
+patch_entry = ">HBB"
+
+def get_changed_sectors(before, after) -> list:
+    """
+    Compare all blocks of two disks of any format, zone by zone with numpy if possible.
+    Returns a list of (lba, changed sectors), changed sectors being a numpy bool array of each sector of the block.
+    """
+    if before.sys_data.disk_type != after.sys_data.disk_type: raise Exception("Cannot compare disks of different Disk Types.")
+    layout = leo64dd.get_layout(before.sys_data.disk_type)
+
+    # compare a whole zone at once if both disks store every block in memory (NDD and MAME)
+    plan = get_convert_plan(after, before)
+    if plan is not None:
+        try:
+            src = numpy.frombuffer(before.raw, dtype=numpy.uint8)
+            dst = numpy.frombuffer(after.raw, dtype=numpy.uint8)
+        except (TypeError, ValueError):
+            plan = None
+
+    changes = []
+    if plan is not None:
+        start = 0
+        for entry, end in zip(plan, leo64dd.vzone_lba_tbl[before.sys_data.disk_type]):
+            size, src_offset, src_rows, dst_offset, dst_rows = entry
+            src_zone = get_zone_rows(src, src_offset, src_rows, size)[src_rows]
+            dst_zone = get_zone_rows(dst, dst_offset, dst_rows, size)[dst_rows]
+            changed = (src_zone != dst_zone).reshape(end - start, leo64dd.sector_count, -1).any(axis=2)
+            for i in numpy.flatnonzero(changed.any(axis=1)).tolist():
+                changes.append((start + i, changed[i]))
+            start = end
+        return changes
+
+    # else compare each block
+    for i in range(leo64dd.lba_count):
+        src_block = numpy.frombuffer(get_source_lba_view(before, i), dtype=numpy.uint8)
+        dst_block = numpy.frombuffer(get_source_lba_view(after, i), dtype=numpy.uint8)
+        changed = (src_block != dst_block).reshape(leo64dd.sector_count, layout.sector_size[i]).any(axis=1)
+        if changed.any(): changes.append((i, changed))
+    return changes
+
+def diff_disks(before, after) -> list:
+    """
+    Compare all blocks of two disks of any format.
+    Returns a list of changed sector ranges as (lba, first sector, sector count).
+    """
+    ranges = []
+    for lba, changed in get_changed_sectors(before, after):
+        # start and end of each run of changed sectors
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([0], changed.view(numpy.int8), [0]))))
+        for first, end in zip(edges[0::2].tolist(), edges[1::2].tolist()):
+            ranges.append((lba, first, end - first))
+    return ranges
+
+def make_patch(before, after, ranges=None) -> bytearray:
+    """
+    Make patch data with the changed sectors from before to after. Ranges are from diff_disks (made if not given).
+    """
+    if ranges is None: ranges = diff_disks(before, after)
+    patch = bytearray(struct.pack(patch_header, b"LEOP", 1, after.sys_data.disk_type, len(ranges)))
+    for lba, first, count in ranges:
+        secsize = leo64dd.size_of_sectors(after.sys_data.disk_type, lba)
+        patch += struct.pack(patch_entry, lba, first, count)
+        patch += get_source_lba_view(after, lba)[first*secsize:(first+count)*secsize]
+    return patch
+
+def read_patch(patch) -> tuple:
+    """
+    Read patch data made with make_patch. Returns (disk type, list of (lba, first sector, sector count, data)).
+    """
+    view = memoryview(patch)
+    start = struct.calcsize(patch_header)
+    if len(view) < start: raise Exception("Wrong size of patch")
+    magic, version, disk_type, count = struct.unpack(patch_header, view[:start])
+    if magic != b"LEOP" or version != 1: raise Exception("This is not a disk patch.")
+
+    entries = []
+    for i in range(count):
+        if len(view) < start + struct.calcsize(patch_entry): raise Exception("Wrong size of patch")
+        lba, first, sectors = struct.unpack(patch_entry, view[start:start+struct.calcsize(patch_entry)])
+        start += struct.calcsize(patch_entry)
+        if lba >= leo64dd.lba_count or first + sectors > leo64dd.sector_count: raise Exception("Wrong patch entry")
+        size = sectors * leo64dd.size_of_sectors(disk_type, lba)
+        if len(view) < start + size: raise Exception("Wrong size of patch")
+        entries.append((lba, first, sectors, view[start:start+size]))
+        start += size
+    if len(view) != start: raise Exception("Wrong size of patch")
+    return disk_type, entries
+
+def apply_patch(disk, patch):
+    """
+    Write all changed sectors of patch data to the disk, at the offsets given by get_lba_offset, and mark them as changed for flush_disk.
+    """
+    disk_type, entries = read_patch(patch)
+    if disk_type != disk.sys_data.disk_type: raise Exception("Patch is for a different Disk Type.")
+    for lba, first, sectors, data in entries:
+        put_block(disk, lba, data, first, sectors)
 
 def basic_disk_file_check(d: bytearray) -> str:
-    if len(d) == size_format_ndd: return "ndd"
+    if len(d) >= 0x200 and d[0:4] == b"LEOZ": return "zdd"
+    elif len(d) == size_format_ndd: return "ndd"
     elif len(d) == size_format_mame: return "mame"
     elif len(d) >= (0x200 + 0x4D08) and len(d) <= (0x200 + 0x3D78F40): return "d64"
     else: return "none"
 
-def load_disk_file(d: bytearray):
-    chk = basic_disk_file_check(d)
-    if chk == "ndd":
-        test = Disk_NDD()
-        test.load(d)
-        print("Disk is NDD format.")
-    elif chk == "mame":
-        test = Disk_MAME()
-        test.load(d)
-        print("Disk is MAME format.")
-    elif chk == "d64":
-        test = Disk_D64()
-        test.load(d)
-        print("Disk is D64 format.")
+def load_disk_file(d: bytearray, verbose=True):
+    with leo64dd.stats_stage("load"):
+        chk = basic_disk_file_check(d)
+        if chk == "ndd":
+            test = Disk_NDD()
+            test.load(d)
+            if verbose == True: print("Disk is NDD format.")
+        elif chk == "mame":
+            test = Disk_MAME()
+            test.load(d)
+            if verbose == True: print("Disk is MAME format.")
+        elif chk == "d64":
+            test = Disk_D64()
+            test.load(d)
+            if verbose == True: print("Disk is D64 format.")
+        elif chk == "zdd":
+            test = Disk_ZDD()
+            test.load(d)
+            if verbose == True: print("Disk is ZDD format.")
+        else:
+            if verbose == True: print("This is not a disk file.")
+            raise Exception("This is not a disk file.")
+        return test
+
+def open_disk_file(path: str, mode="r", stream=False, verbose=True):
+    """
+    Memory-map a disk file and return fully loaded disk class, without reading the whole file in memory.
+    mode = "r"  (read-only)
+         = "r+" (writable, changes are written back to the file)
+         = "c"  (copy-on-write, changes are not written back to the file)
+    Compressed disk files are opened with open_compressed_disk_file (read-only, stream is given to it).
+    The format is printed unless verbose is False.
+    """
+    if open_compressed_file_check(path) == True:
+        if mode == "r+": raise Exception("Compressed disk files cannot be written to.")
+        return open_compressed_disk_file(path, stream, verbose=verbose)
+
+    if mode == "r": access = mmap.ACCESS_READ
+    elif mode == "r+": access = mmap.ACCESS_WRITE
+    elif mode == "c": access = mmap.ACCESS_COPY
+    else: raise ValueError(f"Unknown mode \"{mode}\"")
+
+    with open(path, "r+b" if mode == "r+" else "rb") as f:
+        # an empty file cannot be mapped, let the format check fail on it
+        if os.fstat(f.fileno()).st_size == 0: return load_disk_file(bytearray(), verbose)
+        d = mmap.mmap(f.fileno(), 0, access=access)
+    disk = load_disk_file(d, verbose)
+    # flush_disk needs to know if changes are written to the file
+    disk.mmap_access = access
+    return disk
+
+def open_disk_file_lazy(path: str, verbose=True):
+    """
+    Open a disk file and return fully loaded disk class, only reading the blocks needed to check it.
+    Blocks are then read from the file when asked, memory use does not depend on the file size.
+    The format is printed unless verbose is False.
+    """
+    return load_disk_file(Disk_FileData(path), verbose)
+
+def create_disk_file(path: str, size: int) -> mmap.mmap:
+    """
+    Create a zero-filled file of given size and return a writable memory-map of it, to be used as output of convert().
+    """
+    with open(path, "w+b") as f:
+        f.truncate(size)
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_WRITE)
+
+def convert_to_file(after, disk, out, max_memory=0x100000, scatter=False) -> int:
+    """
+    Convert disk to the format of the after disk class (like after.convert(disk)), but write each block directly
+    to its offset in the output file, in file order, instead of making the whole converted file in memory.
+    out is either a path or a writable file object. At most max_memory bytes are kept in memory before being written.
+    If scatter is True, blocks are read in the storage order of disk instead (see get_storage_lbas) and written
+    at their offset, so the file of disk is read sequentially. (out must be seekable, not used for Disk_ZDD)
+    Only the disk information is kept in after, after.raw is None.
+    Returns the size of the converted file.
+    """
+    if isinstance(out, (str, bytes, os.PathLike)):
+        with open(out, "wb") as outfile:
+            return convert_to_file(after, disk, outfile, max_memory, scatter)
+
+    if type(after) is Disk_ZDD:
+        # compressed size is only known once converted, the whole compressed file is made in memory
+        after.convert(disk)
+        out.write(after.raw)
+        return len(after.raw)
+
+    size = after.convert_info(disk)
+    after.raw = None
+
+    pending = bytearray()
+    written = 0
+    def write_out(data):
+        nonlocal written
+        with leo64dd.stats_stage("file.write"):
+            out.write(data)
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("file.write", len(data))
+        written += len(data)
+    def write(data):
+        if len(pending) + len(data) > max_memory:
+            # write what is pending to keep memory use under the limit
+            write_out(pending)
+            pending.clear()
+            if len(data) > max_memory:
+                write_out(data)
+                return
+        pending.extend(data)
+    def write_zero(n):
+        while n > 0:
+            chunk = min(n, max(max_memory, 1))
+            write(bytes(chunk))
+            n -= chunk
+
+    if scatter == True:
+        # blocks next to each other in the output file are written together, seeking over unused space fills it with zeros
+        file_lbas = set(after.get_file_lbas())
+        start = out.tell()
+        end = start
+        pending.extend(after.get_file_header())
+        for i in get_storage_lbas(disk):
+            if i not in file_lbas: continue
+            offset = start + after.get_lba_offset(i)
+            if offset != out.tell() + len(pending) or len(pending) >= max_memory:
+                write_out(pending)
+                pending.clear()
+                end = max(end, out.tell())
+                out.seek(offset)
+            view = get_source_lba_view(disk, i)
+            pending.extend(view)
+            if leo64dd.stats is not None: leo64dd.add_stats_bytes("copy", len(view))
+        write_out(pending)
+        pending.clear()
+        end = max(end, out.tell())
+
+        # unused space after the last block is written as zeros (truncate() cannot grow every file object)
+        out.seek(end)
+        write_zero(start + size - end)
+        write_out(pending)
+        return size
+
+    write(after.get_file_header())
+    for i in after.get_file_lbas():
+        # fill unused space up to the block
+        write_zero(after.get_lba_offset(i) - written - len(pending))
+        view = get_source_lba_view(disk, i)
+        write(view)
+        if leo64dd.stats is not None: leo64dd.add_stats_bytes("copy", len(view))
+    write_zero(size - written - len(pending))
+
+    write_out(pending)
+    return written
+
+disk_formats = { "ndd": Disk_NDD, "mame": Disk_MAME, "d64": Disk_D64, "zdd": Disk_ZDD }
+
+def find_disk_files(inputs: list) -> list:
+    """
+    Returns the list of files from given paths, directories (searched recursively), glob patterns
+    and manifests ("@" followed by the path of a text file with one entry per line).
+    """
+    files = []
+    for entry in inputs:
+        if entry.startswith("@"):
+            with open(entry[1:], "r") as manifest:
+                lines = [line.strip() for line in manifest]
+            files += find_disk_files([line for line in lines if line != "" and line.startswith("#") == False])
+        elif os.path.isdir(entry):
+            for root, dirs, names in os.walk(entry):
+                dirs.sort()
+                files += [os.path.join(root, name) for name in sorted(names)]
+        elif os.path.isfile(entry):
+            files.append(entry)
+        else:
+            files += find_disk_files([path for path in sorted(glob.glob(entry, recursive=True)) if path != entry])
+    # remove duplicates (even if written differently) while keeping order
+    unique = {}
+    for path in files: unique.setdefault(os.path.abspath(path), path)
+    return list(unique.values())
+
+def convert_disk_file(in_path: str, out_path: str, fmt: str, force=False) -> dict:
+    """
+    Convert disk file to another format ("ndd", "mame", "d64" or "zdd") and write it to out_path.
+    Conversion is skipped if out_path is not older than in_path, unless force is True.
+    Returns a dict with "path", "out", "status" ("done", "skipped", "same" format, or "error"), "error", "size" and "time".
+    """
+    result = { "path": in_path, "out": out_path, "status": "done", "error": None, "size": 0, "time": 0.0 }
+    start = time.perf_counter()
+    try:
+        if force == False and os.path.exists(out_path) and os.stat(out_path).st_mtime >= os.stat(in_path).st_mtime:
+            result["status"] = "skipped"
+        else:
+            # compressed disk files are read as they are decompressed if blocks are written in LBA order
+            disk_obj = open_disk_file(in_path, stream=(fmt != "mame"), verbose=False)
+            try:
+                if type(disk_obj) is disk_formats[fmt]:
+                    result["status"] = "same"
+                else:
+                    # write to a temporary file first so a failed conversion is never taken as up to date
+                    convert_to_file(disk_formats[fmt](), disk_obj, out_path + ".tmp", scatter=(type(disk_obj) is Disk_MAME))
+                    os.replace(out_path + ".tmp", out_path)
+                    result["size"] = len(disk_obj.raw)
+            finally:
+                close_disk_file(disk_obj)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+        if os.path.exists(out_path + ".tmp"): os.remove(out_path + ".tmp")
+    result["time"] = time.perf_counter() - start
+    return result
+
+compressed_extensions = (".gz", ".xz", ".bz2", ".zip")
+
+def get_disk_file_name(path: str) -> str:
+    """
+    Returns the file name of path without its extension, nor its compression extension (".gz", ".xz", ".bz2" or ".zip").
+    """
+    name = os.path.basename(path)
+    if os.path.splitext(name)[1].lower() in compressed_extensions: name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+def batch_convert(inputs: list, fmt: str, out_dir: str, workers=None, force=False) -> list:
+    """
+    Convert all disk files found from inputs (see find_disk_files) to another format ("ndd", "mame", "d64" or "zdd") into out_dir,
+    using a pool of workers processes (default: one per CPU). Prints the result of each file and a summary.
+    Returns the list of results from convert_disk_file.
+    """
+    if fmt not in disk_formats: raise ValueError(f"Unknown \"{fmt}\" format")
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = {}
+    results = []
+    for path in find_disk_files(inputs):
+        out_path = os.path.join(out_dir, get_disk_file_name(path) + "." + fmt)
+        if out_path in jobs.values():
+            results.append({ "path": path, "out": out_path, "status": "error", "error": f"same output file as another file ({out_path})", "size": 0, "time": 0.0 })
+            print(f"[error] {path}: {results[-1]['error']}")
+            continue
+        jobs[path] = out_path
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert_disk_file, path, out_path, fmt, force) for path, out_path in jobs.items()]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["status"] == "error":
+                print(f"[error] {result['path']}: {result['error']}")
+            elif result["status"] == "done":
+                speed = result["size"] / 0x100000 / max(result["time"], 1e-9)
+                print(f"[done] {result['path']} -> {result['out']} ({result['time']:.2f}s, {speed:.1f} MB/s)")
+            else:
+                print(f"[{result['status']}] {result['path']}")
+    elapsed = time.perf_counter() - start
+
+    count = { status: len([r for r in results if r["status"] == status]) for status in ("done", "skipped", "same", "error") }
+    size = sum([r["size"] for r in results])
+    print(f"{len(results)} files: {count['done']} converted, {count['skipped']} up to date, {count['same']} already {fmt}, {count['error']} errors.")
+    print(f"{size / 0x100000:.1f} MB converted in {elapsed:.2f}s ({size / 0x100000 / max(elapsed, 1e-9):.1f} MB/s)")
+    return results
+
+def get_disk_file_format(path: str) -> str:
+    """
+    Returns the format of the disk file at path like basic_disk_file_check, from its size (and header for ZDD) without reading it.
+    """
+    size = os.stat(path).st_size
+    if size >= 0x200:
+        with open(path, "rb") as infile:
+            if infile.read(4) == b"LEOZ": return "zdd"
+    if size == size_format_ndd: return "ndd"
+    elif size == size_format_mame: return "mame"
+    elif size >= (0x200 + 0x4D08) and size <= (0x200 + 0x3D78F40): return "d64"
+    else: return "none"
+
+region_names = { 0xE848D316: "JPN", 0x2263EE56: "USA", 0x00000000: "DEV" }
+
+def scan_disk_file(path: str) -> dict:
+    """
+    Returns the information of the disk file at path as a dict, only reading its System Data and Disk ID.
+    ("path", "size", "mtime", "format", "error", then System Data and Disk ID fields if the disk file is valid.)
+    Errors (including a file that cannot be accessed, "size" and "mtime" are then None) are kept in "error".
+    """
+    record = { "path": path, "size": None, "mtime": None, "format": "none", "error": None }
+    try:
+        stat = os.stat(path)
+        record["size"] = stat.st_size
+        record["mtime"] = stat.st_mtime_ns
+        record["format"] = get_disk_file_format(path)
+        if record["format"] == "none": raise Exception("This is not a disk file.")
+        d = Disk_FileData(path)
+        try:
+            disk = disk_formats[record["format"]]()
+            disk.load(d)
+        finally:
+            d.close()
+    except Exception as e:
+        record["error"] = str(e)
+        return record
+    record.update(get_disk_info(disk))
+    return record
+
+def get_disk_info(disk) -> dict:
+    """
+    Returns the System Data and Disk ID information of a disk class as a dict. (See scan_disk_file.)
+    """
+    sys_data = disk.sys_data
+    disk_id = disk.disk_id
+    return {
+        "region": region_names.get(sys_data.region, f"{sys_data.region:08X}"),
+        "disk_type": sys_data.disk_type,
+        "development": disk.development,
+        "ipl_load_size": sys_data.ipl_load_size,
+        "ipl_load_addr": sys_data.ipl_load_addr,
+        "rom_end_lba": sys_data.rom_end_lba,
+        "ram_start_lba": sys_data.ram_start_lba,
+        "ram_end_lba": sys_data.ram_end_lba,
+        "lba_info_valid": sys_data.is_lba_info_valid(),
+        "initial_code": disk_id.initial_code,
+        "game_version": disk_id.game_version,
+        "disk_number": disk_id.disk_number,
+        "ram_use": disk_id.ram_use,
+        "disk_use": disk_id.disk_use,
+        "factory_line": bytes(disk_id.factory_line).hex(),
+        "production_time": bytes(disk_id.production_time).hex(),
+        "company_code": disk_id.company_code,
+    }
+
+def scan_catalog(inputs: list, cache_path=None, workers=None) -> list:
+    """
+    Scan all disk files found from inputs (see find_disk_files) with scan_disk_file using a pool of workers threads,
+    and return their records as a list.
+    If cache_path is given, records are kept in this JSON file and only files with a different size or mtime are scanned again.
+    A cache file that cannot be read is treated as empty (and replaced).
+    """
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as infile:
+                cache = json.load(infile)
+            if type(cache) is not dict: raise ValueError()
+        except (OSError, ValueError):
+            cache = {}
+
+    files = find_disk_files(inputs)
+    records = {}
+    scan = []
+    for path in files:
+        key = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # scan_disk_file keeps the error in the record
+            scan.append(path)
+            continue
+        entry = cache.get(key)
+        if type(entry) is dict and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime_ns:
+            records[path] = dict(entry, path=path)
+        else:
+            scan.append(path)
+
+    # reading a few blocks per file is mostly waiting for storage, threads are enough
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        for record in pool.map(scan_disk_file, scan):
+            records[record["path"]] = record
+            cache[os.path.abspath(record["path"])] = record
+
+    if cache_path is not None and len(scan) != 0:
+        with open(cache_path + ".tmp", "w") as outfile:
+            json.dump(cache, outfile)
+        os.replace(cache_path + ".tmp", cache_path)
+    return [records[path] for path in files]
+
+def catalog_main(args: list) -> int:
+    """
+    Command line catalog mode: [-j workers] [-c cache_file] [-o out_file] inputs...
+    """
+    workers = None
+    cache_path = None
+    out_path = None
+    rest = []
+    i = 0
+    while i < len(args):
+        if args[i] == "-j" and i + 1 < len(args):
+            workers = int(args[i + 1])
+            i += 1
+        elif args[i] == "-c" and i + 1 < len(args):
+            cache_path = args[i + 1]
+            i += 1
+        elif args[i] == "-o" and i + 1 < len(args):
+            out_path = args[i + 1]
+            i += 1
+        else:
+            rest.append(args[i])
+        i += 1
+    if len(rest) == 0:
+        print(f"Usage: {sys.argv[0]} catalog [-j workers] [-c cache_file] [-o out_file] inputs...")
+        return 2
+    records = scan_catalog(rest, cache_path, workers)
+    if out_path is not None:
+        with open(out_path, "w") as outfile:
+            json.dump(records, outfile, indent=1)
     else:
-        print("This is not a disk file.")
-        raise Exception("This is not a disk file.")
-    return test
+        for record in records: print(json.dumps(record))
+    return 0
+
+def diff_main(args: list) -> int:
+    """
+    Command line diff mode: before_file after_file patch_file
+    """
+    if len(args) != 3:
+        print(f"Usage: {sys.argv[0]} diff before_file after_file patch_file")
+        return 2
+    before = open_disk_file(args[0])
+    after = open_disk_file(args[1])
+    ranges = diff_disks(before, after)
+    patch = make_patch(before, after, ranges)
+    with open(args[2], "wb") as outfile:
+        outfile.write(patch)
+    print(f"{len(set([r[0] for r in ranges]))} blocks changed, {sum([r[2] for r in ranges])} sectors, patch is {len(patch)} bytes.")
+    return 0
+
+def patch_main(args: list) -> int:
+    """
+    Command line patch mode: disk_file patch_file (the disk file is changed)
+    """
+    if len(args) != 2:
+        print(f"Usage: {sys.argv[0]} patch disk_file patch_file")
+        return 2
+    with open(args[1], "rb") as infile:
+        patch = infile.read()
+    disk = open_disk_file(args[0], "r+")
+    apply_patch(disk, patch)
+    flush_disk(disk, fsync=True)
+    print("Complete.")
+    return 0
+
+def batch_main(args: list) -> int:
+    """
+    Command line batch mode: <toformat> out_dir [-j workers] [-f] inputs...
+    """
+    workers = None
+    force = False
+    rest = []
+    i = 0
+    while i < len(args):
+        if args[i] == "-j" and i + 1 < len(args):
+            workers = int(args[i + 1])
+            i += 1
+        elif args[i] == "-f":
+            force = True
+        else:
+            rest.append(args[i])
+        i += 1
+    if len(rest) < 3 or rest[0] not in disk_formats:
+        print(f"Usage: {sys.argv[0]} batch <toformat> out_dir [-j workers] [-f] inputs...")
+        return 2
+    results = batch_convert(rest[2:], rest[0], rest[1], workers, force)
+    if any([r["status"] == "error" for r in results]): return 1
+    return 0
+
+def write_stats(show=True, json_path=None):
+    """
+    Print recorded stats (see leo64dd.get_stats) to stderr if show is True, and save them to a JSON file if json_path is given.
+    """
+    if leo64dd.get_stats() is None: return
+    if show == True: leo64dd.print_stats(lambda line: print(line, file=sys.stderr))
+    if json_path is not None:
+        with open(json_path, "w") as outfile:
+            json.dump(leo64dd.get_stats(), outfile, indent=1)
 
 if __name__ == '__main__':
+    # instrumentation options can be added to any mode
+    stats_show = "--stats" in sys.argv
+    if stats_show == True: sys.argv.remove("--stats")
+    stats_json = None
+    if "--stats-json" in sys.argv[:-1]:
+        i = sys.argv.index("--stats-json")
+        stats_json = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+    if stats_show == True or stats_json is not None:
+        leo64dd.enable_stats()
+        atexit.register(write_stats, stats_show, stats_json)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
+    if len(sys.argv) >= 2 and sys.argv[1] == "catalog":
+        sys.exit(catalog_main(sys.argv[2:]))
+    if len(sys.argv) >= 2 and sys.argv[1] == "diff":
+        sys.exit(diff_main(sys.argv[2:]))
+    if len(sys.argv) >= 2 and sys.argv[1] == "patch":
+        sys.exit(patch_main(sys.argv[2:]))
+
     if (len(sys.argv) != 4):
         print(f"Usage: {sys.argv[0]} <toformat> base_file out_file")
         print(" <toformat> = ndd  (NDD disk image format)")
         print("            = mame (MAME/ares physical disk image format)")
         print("            = d64  (D64 master disk image format, lossy process)")
+        print("            = zdd  (Compressed NDD disk image format)")
+        print(f"       {sys.argv[0]} batch <toformat> out_dir [-j workers] [-f] inputs...")
+        print(" inputs     = files, directories, glob patterns or @manifest (text file with one entry per line)")
+        print(" -j         = amount of worker processes (default: one per CPU)")
+        print(" -f         = convert even if output file is up to date")
+        print(f"       {sys.argv[0]} catalog [-j workers] [-c cache_file] [-o out_file] inputs...")
+        print(" -c         = keep records in cache file, only scan files changed since")
+        print(" -o         = write records to JSON file (default: one JSON record per line)")
+        print(f"       {sys.argv[0]} diff before_file after_file patch_file")
+        print(f"       {sys.argv[0]} patch disk_file patch_file")
+        print(" --stats            = print timings, call counts and byte counts when done (any mode)")
+        print(" --stats-json file  = save them to JSON file (any mode)")
     else:
-        if sys.argv[1] != "ndd" and sys.argv[1] != "mame" and sys.argv[1] != "d64":
+        if sys.argv[1] not in disk_formats:
             print(f"Unknown \" {sys.argv[1]} \" format to convert to.")
             sys.exit(2)
         
-        with open(sys.argv[2], "rb") as infile:
-            disk_img = bytearray(infile.read())
-        disk_obj = load_disk_file(disk_img)
+        disk_obj = open_disk_file(sys.argv[2], stream=(sys.argv[1] != "mame"))
+        # MAME blocks are not stored in LBA order, read them in file order
+        scatter = type(disk_obj) is Disk_MAME
 
         if sys.argv[1] == "ndd":
             # To Disk_NDD
@@ -375,10 +2059,17 @@ if __name__ == '__main__':
                 sys.exit(1)
             print("Converting to D64 format...")
             after = Disk_D64()
+        elif sys.argv[1] == "zdd":
+            # To Disk_ZDD
+            if type(disk_obj) is Disk_ZDD:
+                print("Disk is already ZDD format, cancelling.")
+                sys.exit(1)
+            print("Converting to ZDD format...")
+            after = Disk_ZDD()
         
-        after.convert(disk_obj)
-        print("Conversion done. Writing file...")
-        with open(sys.argv[3], "wb") as outfile:
-            outfile.write(after.raw)
+        # write each block directly to the output file
+        with leo64dd.stats_stage("convert"):
+            convert_to_file(after, disk_obj, sys.argv[3], scatter=scatter)
+        close_disk_file(disk_obj)
         print("Complete.")
         sys.exit(0)
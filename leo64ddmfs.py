@@ -0,0 +1,187 @@
+#
+#   64DD MFS (Multi File System) RAM Area Reader
+#
+
+import sys, os, struct, leo64dd, leo64ddfile
+
+mfs_id = b"64dd-Multi0201"
+mfs_fat_offset = 0x3C
+mfs_fat_count = 2874
+mfs_entry_offset = 0x16B0
+mfs_entry_size = 0x3C
+mfs_entry_count = 899
+
+mfs_fat_free = 0x0000
+mfs_fat_end = 0xFFFF
+
+mfs_attr_directory = 0x8000
+mfs_attr_file = 0x4000
+
+class Disk_MFSEntry:
+    def __init__(self, d: bytearray):
+        self.attribute = leo64dd.read_16(d, 0x00)
+        self.parent_id = leo64dd.read_16(d, 0x02)
+        self.company_code = bytes(d[0x04:0x06]).decode("ASCII", errors="replace")
+        self.game_code = bytes(d[0x06:0x0A]).decode("ASCII", errors="replace")
+        # directory ID for directories, first block (FAT entry) for files
+        self.id = leo64dd.read_16(d, 0x0C)
+        self.size = leo64dd.read_32(d, 0x0E)
+        self.name = bytes(d[0x12:0x26]).split(b"\x00")[0].decode("shift_jis", errors="replace")
+        self.extension = bytes(d[0x26:0x2B]).split(b"\x00")[0].decode("shift_jis", errors="replace")
+        self.copy_count = d[0x2B]
+        self.date = leo64dd.read_32(d, 0x2C)
+        self.renewal = leo64dd.read_16(d, 0x30)
+        self.path = ""
+        # LBAs of the file and error of its FAT chain, only known once the file is read (see Disk_MFS.get_file_blocks)
+        self.blocks = None
+        self.error = None
+
+    def is_directory(self) -> bool:
+        return (self.attribute & mfs_attr_directory) != 0
+
+    def is_file(self) -> bool:
+        return (self.attribute & mfs_attr_file) != 0 and self.is_directory() == False
+
+    def get_full_name(self) -> str:
+        """
+        Returns name with extension.
+        """
+        if self.extension == "": return self.name
+        return f"{self.name}.{self.extension}"
+
+# MFS RAM Area of any disk class
+class Disk_MFS:
+    def __init__(self, disk):
+        """
+        Read volume information, FAT and directory of the RAM Area of disk once.
+        """
+        self.disk = disk
+        sys_data = disk.sys_data
+        if sys_data.is_ram_lba_info_present() == False: raise Exception("Disk has no RAM Area.")
+        self.ram_lba = leo64dd.sys_lba_count + sys_data.ram_start_lba
+        self.ram_lba_count = sys_data.ram_end_lba - sys_data.ram_start_lba + 1
+
+        # read only the blocks holding the volume information, FAT and directory
+        size = mfs_entry_offset + mfs_entry_size * mfs_entry_count
+        d = bytearray()
+        lba = self.ram_lba
+        while len(d) < size and lba < self.ram_lba + self.ram_lba_count:
+            d += disk.get_lba_view(lba)
+            lba += 1
+        if len(d) < size or bytes(d[0x00:0x0E]) != mfs_id: raise Exception("RAM Area is not MFS formatted.")
+
+        self.attribute = leo64dd.read_16(d, 0x0E)
+        self.disk_type = d[0x10]
+        self.volume_name = bytes(d[0x11:0x25]).split(b"\x00")[0].decode("shift_jis", errors="replace")
+        self.date = leo64dd.read_32(d, 0x25)
+        self.renewal = leo64dd.read_16(d, 0x29)
+        self.country = d[0x2B]
+        self.fat = struct.unpack(f">{mfs_fat_count}H", d[mfs_fat_offset:mfs_fat_offset + mfs_fat_count * 2])
+
+        self.entries = []
+        for i in range(mfs_entry_count):
+            offset = mfs_entry_offset + i * mfs_entry_size
+            entry = Disk_MFSEntry(d[offset:offset + mfs_entry_size])
+            if entry.is_directory() == False and entry.is_file() == False: continue
+            self.entries.append(entry)
+
+        # index of directories by ID and full paths
+        directories = { entry.id: entry for entry in self.entries if entry.is_directory() == True }
+        self.paths = {}
+        for entry in self.entries:
+            names = [entry.get_full_name()]
+            parent = directories.get(entry.parent_id)
+            while parent is not None and len(names) <= len(directories):
+                names.insert(0, parent.get_full_name())
+                parent = directories.get(parent.parent_id)
+            entry.path = "/".join(names)
+            self.paths[entry.path] = entry
+
+    def get_file_blocks(self, entry: Disk_MFSEntry) -> list:
+        """
+        Returns the LBAs of a file by following its FAT chain, the first time the file is read.
+        Raises an exception if the FAT chain is broken (kept in entry.error), other files can still be read.
+        """
+        if entry.error is not None: raise Exception(entry.error)
+        if entry.blocks is not None: return entry.blocks
+        blocks = []
+        block = entry.id
+        count = min(self.ram_lba_count, mfs_fat_count)
+        while entry.size != 0:
+            if block == mfs_fat_free or block >= count or len(blocks) >= count:
+                entry.error = f"Broken FAT chain of \"{entry.path}\""
+                raise Exception(entry.error)
+            blocks.append(self.ram_lba + block)
+            block = self.fat[block]
+            if block == mfs_fat_end: break
+        entry.blocks = blocks
+        return blocks
+
+    def list(self) -> list:
+        """
+        Returns all directory and file entries.
+        """
+        return list(self.entries)
+
+    def find(self, path: str) -> Disk_MFSEntry:
+        """
+        Returns the entry of a full path, or None.
+        """
+        return self.paths.get(path.strip("/"))
+
+    def iter_file(self, entry: Disk_MFSEntry):
+        """
+        Yields the data of a file block by block as memoryviews, only reading the blocks used by the file.
+        """
+        if entry.is_file() == False: raise Exception(f"\"{entry.path}\" is not a file.")
+        left = entry.size
+        for lba in self.get_file_blocks(entry):
+            view = self.disk.get_lba_view(lba)
+            if len(view) > left: view = view[:left]
+            left -= len(view)
+            yield view
+        if left > 0: raise Exception(f"File \"{entry.path}\" is bigger than its blocks.")
+
+    def read_file(self, entry: Disk_MFSEntry) -> bytes:
+        """
+        Returns the data of a file.
+        """
+        return b"".join(self.iter_file(entry))
+
+    def extract_file(self, entry: Disk_MFSEntry, out) -> int:
+        """
+        Write the data of a file to out (path or writable file object) block by block. Returns the amount of bytes written.
+        """
+        if isinstance(out, (str, bytes, os.PathLike)):
+            with open(out, "wb") as outfile:
+                return self.extract_file(entry, outfile)
+        written = 0
+        for view in self.iter_file(entry):
+            out.write(view)
+            written += len(view)
+        return written
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 and (len(sys.argv) != 4 or sys.argv[2] != "-x"):
+        print(f"Usage: {sys.argv[0]} disk_file [-x out_dir]")
+        print(" -x = extract all files to out_dir")
+        sys.exit(2)
+
+    disk_obj = leo64ddfile.open_disk_file_lazy(sys.argv[1], verbose=False)
+    mfs = Disk_MFS(disk_obj)
+    print(f"Volume: {mfs.volume_name}")
+    errors = 0
+    for entry in mfs.list():
+        if entry.is_directory() == True: print(f"{'<DIR>':>10} {entry.path}/")
+        else: print(f"{entry.size:>10} {entry.path}")
+        if len(sys.argv) == 4 and entry.is_file() == True:
+            # names come from the disk, never write outside of out_dir
+            path = os.path.join(sys.argv[3], *[name if name not in ("", ".", "..") else "_" for name in entry.path.split("/")])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                mfs.extract_file(entry, path)
+            except Exception as e:
+                print(f"[error] {e}")
+                if os.path.exists(path): os.remove(path)
+                errors += 1
+    sys.exit(1 if errors != 0 else 0)
@@ -0,0 +1,354 @@
+#
+#   64DD Block Server + Client
+#
+
+import sys, os, json, time, random, struct, asyncio, leo64ddfile
+
+request_header = ">IBI"
+response_header = ">IBI"
+max_request_size = 0x1000
+
+command_open = 1
+command_close = 2
+command_get_lba = 3
+command_get_lba_offset = 4
+command_info = 5
+
+status_ok = 0
+status_error = 1
+
+# Open disk classes shared by all clients
+class Disk_Pool:
+    def __init__(self, idle_timeout=60.0):
+        self.idle_timeout = idle_timeout
+        self.disks = {}
+        # disk files being opened, shared by all clients opening the same path
+        self.opening = {}
+        self.opened = 0
+        self.evicted = 0
+
+    async def acquire(self, path: str):
+        """
+        Returns the disk class of the disk file at path, opening it if needed, and adds a reference to it.
+        Disk files are opened in a worker thread (decompressing can be slow) so other clients are not blocked.
+        """
+        path = os.path.abspath(path)
+        entry = self.disks.get(path)
+        if entry is None:
+            task = self.opening.get(path)
+            if task is None:
+                task = asyncio.ensure_future(self.open(path))
+                self.opening[path] = task
+            entry = await task
+        entry[1] += 1
+        return entry[0]
+
+    async def open(self, path: str) -> list:
+        try:
+            disk = await asyncio.get_running_loop().run_in_executor(None, lambda: leo64ddfile.open_disk_file(path, verbose=False))
+        finally:
+            del self.opening[path]
+        # disk class, references, time of last release
+        entry = [disk, 0, time.monotonic()]
+        self.disks[path] = entry
+        self.opened += 1
+        return entry
+
+    def release(self, path: str):
+        """
+        Removes a reference to the disk file at path. It is closed once not used for idle_timeout seconds.
+        """
+        entry = self.disks[os.path.abspath(path)]
+        entry[1] -= 1
+        entry[2] = time.monotonic()
+
+    def evict_idle(self) -> int:
+        """
+        Close all disk files without references and not used for idle_timeout seconds. Returns the amount closed.
+        """
+        now = time.monotonic()
+        count = 0
+        for path, entry in list(self.disks.items()):
+            if entry[1] == 0 and now - entry[2] >= self.idle_timeout:
+                del self.disks[path]
+                leo64ddfile.close_disk_file(entry[0])
+                count += 1
+        self.evicted += count
+        return count
+
+    def get_stats(self) -> dict:
+        return { "open": len(self.disks), "opened": self.opened, "evicted": self.evicted,
+                 "references": sum([entry[1] for entry in self.disks.values()]) }
+
+async def run_disk_read(disk, func):
+    """
+    Returns the result of func reading data of disk. Unless the disk data is already in memory (bytearray, not ZDD),
+    func runs in a worker thread so reading from storage or decompressing does not block other clients.
+    """
+    if type(disk) is not leo64ddfile.Disk_ZDD and type(disk.raw) is bytearray: return func()
+    return await asyncio.get_running_loop().run_in_executor(None, func)
+
+async def handle_request(pool: Disk_Pool, handles: dict, command: int, payload: bytes) -> bytes:
+    """
+    Run a single request of a client, handles being the dict of handle to path of its open disk files.
+    Returns the response data, raises an exception on error.
+    """
+    if command == command_open:
+        path = payload.decode("UTF-8")
+        await pool.acquire(path)
+        handle = max(handles, default=0) + 1
+        handles[handle] = path
+        return struct.pack(">I", handle)
+
+    if len(payload) < 4: raise Exception("Wrong size of request")
+    handle = struct.unpack(">I", payload[:4])[0]
+    if handle not in handles: raise Exception("Unknown disk handle")
+    if command == command_close:
+        pool.release(handles.pop(handle))
+        return b""
+
+    disk = pool.disks[os.path.abspath(handles[handle])][0]
+    if command == command_get_lba or command == command_get_lba_offset:
+        if len(payload) != 8: raise Exception("Wrong size of request")
+        lba = struct.unpack(">I", payload[4:8])[0]
+        if lba >= leo64ddfile.leo64dd.lba_count: raise Exception("Wrong LBA")
+        if command == command_get_lba_offset: return struct.pack(">q", disk.get_lba_offset(lba))
+        return await run_disk_read(disk, lambda: bytes(disk.get_lba_view(lba)))
+    elif command == command_info:
+        info = { "format": [name for name, c in leo64ddfile.disk_formats.items() if type(disk) is c][0] }
+        info.update(leo64ddfile.get_disk_info(disk))
+        return json.dumps(info).encode("UTF-8")
+    raise Exception("Unknown command")
+
+async def handle_client(pool: Disk_Pool, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_pending=64):
+    """
+    Answer all requests of a client in order. Requests can be sent without waiting for responses (pipelining),
+    at most max_pending of them are read in advance, then the client is not read until responses are sent.
+    """
+    queue = asyncio.Queue(max_pending)
+    handles = {}
+
+    async def read_requests():
+        try:
+            while True:
+                request_id, command, size = struct.unpack(request_header, await reader.readexactly(struct.calcsize(request_header)))
+                if size > max_request_size: break
+                # waits here if too many requests are pending
+                await queue.put((request_id, command, await reader.readexactly(size)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        await queue.put(None)
+
+    task = asyncio.create_task(read_requests())
+    try:
+        while True:
+            request = await queue.get()
+            if request is None: break
+            request_id, command, payload = request
+            try:
+                status = status_ok
+                data = await handle_request(pool, handles, command, payload)
+            except Exception as e:
+                status = status_error
+                data = str(e).encode("UTF-8")
+            writer.write(struct.pack(response_header, request_id, status, len(data)))
+            writer.write(data)
+            # waits here if the client does not read responses fast enough
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        task.cancel()
+        for path in handles.values(): pool.release(path)
+        writer.close()
+
+# asyncio server giving blocks of disk files to clients
+class Disk_Server:
+    def __init__(self, host="127.0.0.1", port=6464, unix_path=None, idle_timeout=60.0, max_pending=64):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.max_pending = max_pending
+        self.pool = Disk_Pool(idle_timeout)
+        self.server = None
+        self.evict_task = None
+        # handler task of each connected client, to its writer
+        self.clients = {}
+
+    async def start(self):
+        """
+        Start listening on TCP host and port, or on the Unix socket unix_path if given.
+        """
+        if self.unix_path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, self.unix_path)
+        else:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port)
+            # port 0 takes any free port
+            self.port = self.server.sockets[0].getsockname()[1]
+        self.evict_task = asyncio.create_task(self.evict())
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.clients[task] = writer
+        try:
+            await handle_client(self.pool, reader, writer, self.max_pending)
+        finally:
+            del self.clients[task]
+
+    async def evict(self):
+        while True:
+            await asyncio.sleep(max(self.pool.idle_timeout / 2, 0.1))
+            self.pool.evict_idle()
+
+    async def serve_forever(self):
+        if self.server is None: await self.start()
+        await self.server.serve_forever()
+
+    async def close(self):
+        """
+        Stop listening, close the connections of all clients and wait for their requests to end.
+        """
+        self.evict_task.cancel()
+        self.server.close()
+        for writer in list(self.clients.values()): writer.close()
+        await asyncio.gather(*list(self.clients), return_exceptions=True)
+        await self.server.wait_closed()
+
+# asyncio client of Disk_Server
+class Disk_Client:
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.next_id = 0
+        self.task = None
+
+    async def connect(self, host="127.0.0.1", port=6464, unix_path=None):
+        """
+        Connect to a Disk_Server on TCP host and port, or on the Unix socket unix_path if given.
+        """
+        if unix_path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.task = asyncio.create_task(self.read_responses())
+
+    async def read_responses(self):
+        try:
+            while True:
+                request_id, status, size = struct.unpack(response_header, await self.reader.readexactly(struct.calcsize(response_header)))
+                data = await self.reader.readexactly(size)
+                future = self.pending.pop(request_id)
+                if status == status_ok: future.set_result(data)
+                else: future.set_exception(Exception(data.decode("UTF-8")))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for future in self.pending.values():
+                future.set_exception(ConnectionError("Connection to disk server lost"))
+            self.pending.clear()
+
+    async def request(self, command: int, payload: bytes) -> bytes:
+        """
+        Send a request and wait for its response. Several requests can be waited for at the same time (pipelining).
+        """
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(struct.pack(request_header, request_id, command, len(payload)) + payload)
+        await self.writer.drain()
+        return await future
+
+    async def open(self, path: str) -> int:
+        """
+        Open disk file at path on the server (path as seen by the server), and return its handle.
+        """
+        return struct.unpack(">I", await self.request(command_open, path.encode("UTF-8")))[0]
+
+    async def close_disk(self, handle: int):
+        await self.request(command_close, struct.pack(">I", handle))
+
+    async def get_lba(self, handle: int, lba: int) -> bytes:
+        return await self.request(command_get_lba, struct.pack(">II", handle, lba))
+
+    async def get_lba_offset(self, handle: int, lba: int) -> int:
+        return struct.unpack(">q", await self.request(command_get_lba_offset, struct.pack(">II", handle, lba)))[0]
+
+    async def get_info(self, handle: int) -> dict:
+        return json.loads(await self.request(command_info, struct.pack(">I", handle)))
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            # the server closed the connection first
+            pass
+        self.task.cancel()
+
+async def run_load(path: str, clients=4, requests=1000, depth=16, host="127.0.0.1", port=6464, unix_path=None, seed=0) -> dict:
+    """
+    Load generator: each of the clients reads requests random blocks of the disk file at path, with depth requests pipelined.
+    Returns a dict with "requests", "bytes", "time" (seconds), "ops" (requests per second), "latency_avg" and "latency_max" (seconds).
+    """
+    latencies = []
+    total = 0
+
+    async def run_client(index):
+        nonlocal total
+        rnd = random.Random(seed + index)
+        client = Disk_Client()
+        await client.connect(host, port, unix_path)
+        handle = await client.open(path)
+        slots = asyncio.Semaphore(depth)
+        async def read(lba):
+            nonlocal total
+            async with slots:
+                start = time.perf_counter()
+                total += len(await client.get_lba(handle, lba))
+                latencies.append(time.perf_counter() - start)
+        await asyncio.gather(*[read(rnd.randrange(leo64ddfile.leo64dd.lba_count)) for i in range(requests)])
+        await client.close_disk(handle)
+        await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(i) for i in range(clients)])
+    elapsed = time.perf_counter() - start
+    return { "requests": len(latencies), "bytes": total, "time": elapsed, "ops": len(latencies) / max(elapsed, 1e-9),
+             "latency_avg": sum(latencies) / max(len(latencies), 1), "latency_max": max(latencies, default=0.0) }
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    mode = args[0] if len(args) != 0 else None
+    options = { "-p": "6464", "-u": None, "-i": "60", "-c": "4", "-n": "1000", "-d": "16" }
+    rest = []
+    i = 1
+    while i < len(args):
+        if args[i] in options and i + 1 < len(args):
+            options[args[i]] = args[i + 1]
+            i += 1
+        else:
+            rest.append(args[i])
+        i += 1
+
+    if mode == "serve" and len(rest) == 0:
+        server = Disk_Server(port=int(options["-p"]), unix_path=options["-u"], idle_timeout=float(options["-i"]))
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    elif mode == "load" and len(rest) == 1:
+        result = asyncio.run(run_load(rest[0], int(options["-c"]), int(options["-n"]), int(options["-d"]), port=int(options["-p"]), unix_path=options["-u"]))
+        print(f"{result['requests']} requests in {result['time']:.2f}s: {result['ops']:.1f} requests/s, {result['bytes'] / 0x100000 / max(result['time'], 1e-9):.1f} MB/s")
+        print(f"Latency: {result['latency_avg'] * 1000:.3f} ms average, {result['latency_max'] * 1000:.3f} ms max")
+        sys.exit(0)
+    else:
+        print(f"Usage: {sys.argv[0]} serve [-p port] [-u unix_socket] [-i idle_timeout]")
+        print(f"       {sys.argv[0]} load [-p port] [-u unix_socket] [-c clients] [-n requests] [-d depth] disk_file")
+        print(" -p = TCP port on 127.0.0.1 (default: 6464)")
+        print(" -u = Unix socket path, used instead of TCP port")
+        print(" -i = seconds before an unused disk file is closed (default: 60)")
+        print(" -c = amount of clients (default: 4)")
+        print(" -n = amount of random block reads per client (default: 1000)")
+        print(" -d = amount of pipelined requests per client (default: 16)")
+        sys.exit(2)